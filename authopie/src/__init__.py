@@ -1,6 +1,6 @@
 from pydantic import ValidationError
 import sys
-from .utils.logger import get_logger, test_logger  # noqa F401
+from .utils.logger import configure_logger, get_logger, test_logger  # noqa F401,E501
 from .utils.config import load_config
 
 # initialze custom logging
@@ -13,3 +13,6 @@ except ValidationError as exc:
     logger.warn('Corrupt or Incorrect config file')
     logger.debug(exc)
     sys.exit()
+
+# apply configured level and format
+configure_logger(logger, config.LOG_LEVEL, config.LOG_FORMAT)
@@ -1,3 +1,6 @@
-from .role import get_role, get_all_roles, create_role, update_role, delete_role  # noqa:F401,E501
-from .user import get_user, get_all_users, create_user, update_user, delete_user, authenticate_user  # noqa:F401,E501
-from .key_pair import create_key_pair, get_key_pair, get_all_key_pairs, get_valid_key_pairs, get_random_valid_key_pair, delete_key_pair  # noqa:F401,E501
+from .role import get_role, get_all_roles, get_roles_page, stream_roles, create_role, update_role, delete_role, bump_token_versions  # noqa:F401,E501
+from .user import get_user, get_principal, get_all_users, get_users_page, stream_users, create_user, update_user, delete_user, authenticate_user, clear_principals, get_token_version, invalidate_tokens  # noqa:F401,E501
+from .key_pair import create_key_pair, get_key_pair, get_verification_key, get_all_key_pairs, get_valid_key_pairs, get_signing_key_pairs, get_random_valid_key_pair, get_signing_key, add_key_pair, rotate_key_pairs, get_jwks, delete_key_pair, clear_key_caches  # noqa:F401,E501
+from .bulk import import_all, merge_all  # noqa:F401,E501
+from .revoked_token import revoke_token, is_token_revoked, get_revoked_jtis_since, stream_revoked_jtis, delete_expired_revoked_tokens  # noqa:F401,E501
+from .scope import get_scopes, get_scope_ids, sync_role_scopes, delete_role_scopes, rebuild_scope_catalog, backfill_scope_catalog  # noqa:F401,E501
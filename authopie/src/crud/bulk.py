@@ -0,0 +1,507 @@
+import uuid
+from typing import Any, AsyncIterator
+
+import pydantic
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import delete, insert, select, update
+
+from .. import logger, models, schemas
+from ..exceptions import ImportFailedException
+from .cache import principals, token_versions
+from .role import bump_token_versions
+from .scope import (delete_role_scopes, rebuild_scope_catalog,
+                    sync_role_scopes)
+
+# entry keys of import documents (json: lists, jsonl: single entries)
+ENTITIES = {
+    'roles': 'role',
+    'role': 'role',
+    'users': 'user',
+    'user': 'user',
+}
+
+
+class BulkImporter:
+    """
+    Imports roles and users with batched bulk inserts
+    - add: validates one entry and queues it, full batches are inserted
+    - finish: inserts the rest, returns number of imported rows
+    nothing is committed, the caller commits once everything worked
+    memberships of users are inserted once their roles are known
+    (documents may list users before roles)
+    """
+
+    def __init__(
+        self,
+        import_users: bool,
+        import_roles: bool,
+        batch_size: int,
+        db: AsyncSession
+    ):
+        self.import_users = import_users
+        self.import_roles = import_roles
+        self.batch_size = batch_size
+        self.db = db
+        self.role_ids: set = set()
+        self.roles_done = not import_roles
+        self.counts = dict(roles=0, users=0, user_roles=0)
+        # version of imported users, above the version of replaced users
+        self.token_version = 0
+        self._rows: dict[type, list[dict]] = {
+            models.Role: [],
+            models.User: [],
+            models.UserRole: [],
+        }
+        # memberships whose roles may still follow
+        self._pending_user_roles: list[dict] = []
+
+    async def load_existing_roles(self) -> None:
+        """ users may be assigned to roles already in db """
+        stmt = select(models.Role.id)
+        self.role_ids = set((await self.db.execute(stmt)).scalars().all())
+
+    async def add(self, key: str, entry: Any) -> None:
+        entity = ENTITIES.get(key)
+
+        try:
+            if entity == 'role' and self.import_roles:
+                role = schemas.RoleInDB.parse_obj(entry)
+                self.role_ids.add(role.id)
+                await self._queue(models.Role, role.dict())
+                self.counts['roles'] += 1
+
+            elif entity == 'user' and self.import_users:
+                user = schemas.UserInDB.parse_obj(entry)
+                row = user.dict(exclude={'roles'})
+                row['token_version'] = self.token_version
+                await self._queue(models.User, row)
+                self.counts['users'] += 1
+                for role in user.roles or []:
+                    await self._queue_user_role(user.id, role.id)
+
+        except pydantic.ValidationError as exc:
+            raise ImportFailedException(f'Invalid {entity}: {exc}')
+
+        if entity == 'user' and self.import_roles and self.counts['roles']:
+            # roles are listed first -> all of them are known by now
+            self.roles_done = True
+
+    async def _queue(self, model: type, row: dict) -> None:
+        rows = self._rows[model]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            await self._flush(model)
+
+    async def _queue_user_role(self, user_id, role_id) -> None:
+        row = dict(user_id=user_id, role_id=role_id)
+        if not self.roles_done:
+            self._pending_user_roles.append(row)
+            return
+        self._check_role(row)
+        await self._queue(models.UserRole, row)
+
+    def _check_role(self, row: dict) -> None:
+        if row['role_id'] not in self.role_ids:
+            raise ImportFailedException(
+                f'User {row["user_id"]} has unknown role {row["role_id"]}')
+
+    async def _flush(self, model: type) -> None:
+        rows = self._rows[model]
+        if len(rows) == 0:
+            return
+        if model is models.UserRole:
+            # referenced users and roles have to be inserted first
+            await self._flush(models.Role)
+            await self._flush(models.User)
+        try:
+            await self.db.execute(insert(model), rows)
+        except IntegrityError as exc:
+            raise ImportFailedException(
+                f'Duplicate or conflicting {model.__tablename__}: '
+                f'{exc.orig}')
+        if model is models.UserRole:
+            self.counts['user_roles'] += len(rows)
+        self._rows[model] = []
+        logger.info(
+            f'Import progress: {self.counts["roles"]} roles, '
+            f'{self.counts["users"]} users'
+        )
+
+    async def finish(self) -> dict[str, int]:
+        """ inserts remaining rows (roles before users/memberships) """
+
+        self.roles_done = True
+        for row in self._pending_user_roles:
+            self._check_role(row)
+            await self._queue(models.UserRole, row)
+        self._pending_user_roles = []
+
+        await self._flush(models.Role)
+        await self._flush(models.User)
+        await self._flush(models.UserRole)
+        return self.counts
+
+
+async def import_all(
+    entries: AsyncIterator[tuple[str, Any]],
+    import_users: bool,
+    import_roles: bool,
+    batch_size: int,
+    db: AsyncSession
+) -> dict[str, int]:
+    """
+    replaces users and/or roles with the given entries (streamed)
+    - one transaction: on failure nothing is changed
+    - key pairs are kept
+    - importing roles resets role memberships of users that are kept
+    - tokens issued before the import are rejected afterwards
+    Success: returns number of imported roles, users and memberships
+    Failure (invalid entry, unknown role, duplicate): ImportFailedException
+    """
+
+    importer = BulkImporter(import_users, import_roles, batch_size, db)
+
+    try:
+        if import_users:
+            # tokens of replaced users carry a version <= the highest one
+            stmt = select(func.max(models.User.token_version))
+            importer.token_version = (await db.scalar(stmt) or 0) + 1
+        elif import_roles:
+            # kept users lose their memberships -> their tokens too
+            await models.User.bump_token_version(db)
+
+        # memberships reference users and roles -> delete them first
+        if import_users or import_roles:
+            await db.execute(delete(models.UserRole))
+        if import_users:
+            await db.execute(delete(models.User))
+        if import_roles:
+            await db.execute(delete(models.RoleScope))
+            await db.execute(delete(models.Role))
+        else:
+            await importer.load_existing_roles()
+
+        async for key, entry in entries:
+            await importer.add(key, entry)
+
+        counts = await importer.finish()
+        if import_roles:
+            # scope catalog of the imported roles
+            await rebuild_scope_catalog(db)
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+
+    # cached users might be gone or have other roles now
+    principals.clear()
+    token_versions.clear()
+
+    logger.info(
+        f'Imported {counts["roles"]} roles, {counts["users"]} users '
+        f'and {counts["user_roles"]} role memberships'
+    )
+    return counts
+
+
+class MergeImporter:
+    """
+    Merges roles and users into db, matched by role name and username
+    - add: validates one entry, users are merged batch by batch
+    - finish: merges the rest, deletes users/roles missing in the import
+    only changed rows are written (inserts, updates, deletes in bulk)
+    ids of the import are ignored, new rows get new ids
+    nothing is committed, the caller commits once everything worked
+    """
+
+    def __init__(
+        self,
+        import_users: bool,
+        import_roles: bool,
+        batch_size: int,
+        db: AsyncSession
+    ):
+        self.import_users = import_users
+        self.import_roles = import_roles
+        self.batch_size = batch_size
+        self.db = db
+        # role name -> [id, scopes] (db state, updated while merging)
+        self.roles: dict[str, list] = {}
+        self.seen_roles: set[str] = set()
+        self.seen_users: set[str] = set()
+        # usernames of users that were changed or deleted
+        self.changed_users: set[str] = set()
+        self.roles_done = not import_roles
+        self.counts = dict(
+            roles=dict(inserted=0, updated=0, deleted=0, unchanged=0),
+            users=dict(inserted=0, updated=0, deleted=0, unchanged=0),
+            user_roles=dict(inserted=0, deleted=0)
+        )
+        self._users: list[schemas.UserInDB] = []
+
+    async def load_roles(self) -> None:
+        stmt = select(models.Role.id, models.Role.name, models.Role.scopes)
+        for role_id, name, scopes in await self.db.execute(stmt):
+            self.roles[name] = [role_id, scopes]
+
+    async def add(self, key: str, entry: Any) -> None:
+        entity = ENTITIES.get(key)
+
+        try:
+            if entity == 'role' and self.import_roles:
+                await self._merge_role(schemas.RoleInDB.parse_obj(entry))
+
+            elif entity == 'user' and self.import_users:
+                if self.import_roles and len(self.seen_roles) > 0:
+                    # roles are listed first -> all of them are known
+                    self.roles_done = True
+                self._users.append(schemas.UserInDB.parse_obj(entry))
+                # users listed before roles wait until finish
+                if self.roles_done and len(self._users) >= self.batch_size:
+                    await self._merge_users()
+
+        except pydantic.ValidationError as exc:
+            raise ImportFailedException(f'Invalid {entity}: {exc}')
+
+    async def _merge_role(self, role: schemas.RoleInDB) -> None:
+        if role.name in self.seen_roles:
+            raise ImportFailedException(f'Duplicate role {role.name}')
+        self.seen_roles.add(role.name)
+
+        current = self.roles.get(role.name)
+        if current is None:
+            role_id = uuid.uuid4()
+            await self.db.execute(insert(models.Role), [
+                dict(id=role_id, name=role.name, scopes=role.scopes)])
+            await sync_role_scopes(role_id, role.scopes, self.db)
+            self.roles[role.name] = [role_id, role.scopes]
+            self.counts['roles']['inserted'] += 1
+        elif current[1] != role.scopes:
+            await self.db.execute(update(models.Role), [
+                dict(id=current[0], scopes=role.scopes)])
+            # tokens of users with this role carry the old scopes
+            await bump_token_versions(current[0], self.db)
+            await sync_role_scopes(current[0], role.scopes, self.db)
+            current[1] = role.scopes
+            self.counts['roles']['updated'] += 1
+        else:
+            self.counts['roles']['unchanged'] += 1
+
+    def _role_ids(self, user: schemas.UserInDB) -> set:
+        """ ids of the roles of user (by name) """
+        role_ids = set()
+        for role in user.roles or []:
+            if role.name not in self.roles:
+                raise ImportFailedException(
+                    f'User {user.username} has unknown role {role.name}')
+            role_ids.add(self.roles[role.name][0])
+        return role_ids
+
+    async def _merge_users(self) -> None:
+        """ merges queued users with one lookup per batch """
+
+        users, self._users = self._users, []
+        if len(users) == 0:
+            return
+
+        usernames = [user.username for user in users]
+        duplicates = self.seen_users.intersection(usernames)
+        if len(duplicates) > 0 or len(set(usernames)) != len(usernames):
+            raise ImportFailedException(
+                f'Duplicate users {duplicates or usernames}')
+        self.seen_users.update(usernames)
+
+        # current state of the users in this batch
+        stmt = (
+            select(models.User.id, models.User.username,
+                   models.User.hashed_password)
+            .where(models.User.username.in_(usernames))
+        )
+        existing = {
+            username: (user_id, hashed_password)
+            for user_id, username, hashed_password
+            in await self.db.execute(stmt)
+        }
+        memberships: dict = {user_id: set() for user_id, _ in
+                             existing.values()}
+        if len(memberships) > 0:
+            stmt = (
+                select(models.UserRole.user_id, models.UserRole.role_id)
+                .where(models.UserRole.user_id.in_(memberships))
+            )
+            for user_id, role_id in await self.db.execute(stmt):
+                memberships[user_id].add(role_id)
+
+        new_users, updated_users, changed_ids = [], [], []
+        new_user_roles, old_user_roles = [], []
+
+        for user in users:
+            role_ids = self._role_ids(user)
+
+            if user.username not in existing:
+                user_id = uuid.uuid4()
+                new_users.append(dict(
+                    id=user_id,
+                    username=user.username,
+                    hashed_password=user.hashed_password
+                ))
+                new_user_roles.extend(
+                    dict(user_id=user_id, role_id=role_id)
+                    for role_id in role_ids
+                )
+                continue
+
+            user_id, hashed_password = existing[user.username]
+            current_role_ids = memberships[user_id]
+            changed = False
+
+            if hashed_password != user.hashed_password:
+                updated_users.append(dict(
+                    id=user_id, hashed_password=user.hashed_password))
+                changed = True
+
+            if role_ids != current_role_ids:
+                new_user_roles.extend(
+                    dict(user_id=user_id, role_id=role_id)
+                    for role_id in role_ids - current_role_ids
+                )
+                old_user_roles.extend(
+                    (user_id, role_id)
+                    for role_id in current_role_ids - role_ids
+                )
+                changed = True
+
+            if changed:
+                changed_ids.append(user_id)
+                self.changed_users.add(user.username)
+                self.counts['users']['updated'] += 1
+            else:
+                self.counts['users']['unchanged'] += 1
+
+        if len(new_users) > 0:
+            await self.db.execute(insert(models.User), new_users)
+            self.counts['users']['inserted'] += len(new_users)
+        if len(updated_users) > 0:
+            await self.db.execute(update(models.User), updated_users)
+        if len(changed_ids) > 0:
+            # tokens issued before carry the old password / scopes
+            await models.User.bump_token_version(
+                self.db, models.User.id.in_(changed_ids))
+        if len(old_user_roles) > 0:
+            await self.db.execute(delete(models.UserRole).where(
+                tuple_(models.UserRole.user_id, models.UserRole.role_id)
+                .in_(old_user_roles)
+            ))
+            self.counts['user_roles']['deleted'] += len(old_user_roles)
+        if len(new_user_roles) > 0:
+            await self.db.execute(insert(models.UserRole), new_user_roles)
+            self.counts['user_roles']['inserted'] += len(new_user_roles)
+
+        logger.info(
+            f'Merge progress: {len(self.seen_users)} users compared')
+
+    async def _delete_users(self, user_ids: list) -> None:
+        await self.db.execute(delete(models.UserRole).where(
+            models.UserRole.user_id.in_(user_ids)))
+        await self.db.execute(delete(models.User).where(
+            models.User.id.in_(user_ids)))
+        self.counts['users']['deleted'] += len(user_ids)
+
+    async def finish(self) -> dict[str, dict[str, int]]:
+        """ merges remaining users, deletes users/roles not imported """
+
+        self.roles_done = True
+        users, self._users = self._users, []
+        for start in range(0, len(users), self.batch_size):
+            self._users = users[start:start + self.batch_size]
+            await self._merge_users()
+
+        if self.import_users:
+            # users missing in the import, looked up batch by batch
+            # (keyset by username, deleted rows do not shift batches)
+            after = ''
+            while True:
+                stmt = (
+                    select(models.User.id, models.User.username)
+                    .where(models.User.username > after)
+                    .order_by(models.User.username)
+                    .limit(self.batch_size)
+                )
+                rows = (await self.db.execute(stmt)).all()
+                if len(rows) == 0:
+                    break
+                after = rows[-1][1]
+                missing = []
+                for user_id, username in rows:
+                    if username not in self.seen_users:
+                        missing.append(user_id)
+                        self.changed_users.add(username)
+                if len(missing) > 0:
+                    await self._delete_users(missing)
+
+        if self.import_roles:
+            role_ids = [
+                role_id for name, (role_id, _) in self.roles.items()
+                if name not in self.seen_roles
+            ]
+            if len(role_ids) > 0:
+                for role_id in role_ids:
+                    await bump_token_versions(role_id, self.db)
+                await self.db.execute(delete(models.UserRole).where(
+                    models.UserRole.role_id.in_(role_ids)))
+                await delete_role_scopes(role_ids, self.db)
+                await self.db.execute(delete(models.Role).where(
+                    models.Role.id.in_(role_ids)))
+                self.counts['roles']['deleted'] += len(role_ids)
+
+        return self.counts
+
+    @property
+    def roles_changed(self) -> bool:
+        counts = self.counts['roles']
+        return counts['inserted'] + counts['updated'] + counts['deleted'] > 0
+
+
+async def merge_all(
+    entries: AsyncIterator[tuple[str, Any]],
+    import_users: bool,
+    import_roles: bool,
+    batch_size: int,
+    db: AsyncSession
+) -> dict[str, dict[str, int]]:
+    """
+    merges given users and/or roles (streamed) into db
+    - matched by username / role name, only differences are written
+    - users/roles missing in the import are deleted
+    - one transaction: on failure nothing is changed
+    Success: returns inserted/updated/deleted/unchanged counts
+    Failure (invalid entry, unknown role, duplicate): ImportFailedException
+    """
+
+    importer = MergeImporter(import_users, import_roles, batch_size, db)
+
+    try:
+        await importer.load_roles()
+
+        async for key, entry in entries:
+            await importer.add(key, entry)
+
+        counts = await importer.finish()
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+
+    # drop cached users that changed
+    if importer.roles_changed:
+        principals.clear()
+        token_versions.clear()
+    else:
+        for username in importer.changed_users:
+            principals.pop(username)
+            token_versions.pop(username)
+
+    logger.info(f'Merged import: {counts}')
+    return counts
@@ -0,0 +1,18 @@
+""" in memory caches shared by crud modules """
+
+from .. import config
+from ..utils.cache import TTLCache
+
+# users (incl. roles) by username, used for token auth
+principals = TTLCache(
+    config.PRINCIPAL_CACHE_SIZE,
+    config.PRINCIPAL_CACHE_TTL,
+    name='principals'
+)
+
+# token versions by username, used for stateless token auth
+token_versions = TTLCache(
+    config.PRINCIPAL_CACHE_SIZE,
+    config.PRINCIPAL_CACHE_TTL,
+    name='token_versions'
+)
@@ -1,17 +1,39 @@
+import asyncio
+import hashlib
 import random
 import secrets
 from datetime import datetime, timedelta
 
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from sqlalchemy.orm import Session
-from sqlalchemy.sql.expression import delete
+from jose import jwk
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import delete, true
 
 from .. import config, logger, models, schemas
 from ..exceptions import EntityDoesNotExistException
+from ..utils import metrics
+from ..utils.cache import TTLCache
+from ..utils.keys import (SigningKey, SigningKeyRing, VerificationKey,
+                          generate_key_pair, load_public_key)
 
+# parsed public keys by kid, used for validating tokens
+verification_keys = TTLCache(
+    config.KEY_CACHE_SIZE,
+    config.KEY_CACHE_TTL,
+    name='verification_keys'
+)
 
-def get_key_pair(kid: str, db: Session) -> schemas.KeyPair:
+# key pairs stop signing this long before they expire,
+# so every token they signed can still be validated
+RETIRE_GRACE = timedelta(days=config.REFRESH_TOKEN_LIFETIME)
+
+# parsed private keys of all signing key pairs, used for signing tokens
+signing_keys = SigningKeyRing(config.SIGNING_KEY_REFRESH, RETIRE_GRACE)
+
+# serialized json web key set (body, etag) of all valid key pairs
+jwks_documents = TTLCache(1, config.JWKS_CACHE_TTL, name='jwks')
+
+
+async def get_key_pair(kid: str, db: AsyncSession) -> schemas.KeyPair:
     """
     get key pair from db by key id
     Success: return KeyPair
@@ -19,7 +41,7 @@ def get_key_pair(kid: str, db: Session) -> schemas.KeyPair:
     """
 
     # find key_pair by kid
-    key_pair: models.KeyPair = models.KeyPair.get_by_kid(kid, db)
+    key_pair: models.KeyPair = await models.KeyPair.get_by_kid(kid, db)
 
     if key_pair is None:
         raise EntityDoesNotExistException('KeyPair')
@@ -27,7 +49,36 @@ def get_key_pair(kid: str, db: Session) -> schemas.KeyPair:
     return schemas.KeyPair.from_orm(key_pair)
 
 
-def get_all_key_pairs(db: Session) -> list[schemas.KeyPair]:
+async def get_verification_key(
+    kid: str,
+    db: AsyncSession
+) -> VerificationKey:
+    """
+    get parsed public key (and algorithm) of key pair by key id
+    only hits the db if the key is not cached yet
+    Success: return VerificationKey
+    Failure (no key pair with kid): raise EntityDoesNotExistException
+    """
+
+    key = verification_keys.get(kid)
+    if key is not None:
+        return key
+
+    # load key pair from db and parse public key PEM
+    key_pair = await get_key_pair(kid, db)
+    key = VerificationKey(
+        alg=key_pair.alg,
+        public_key=load_public_key(key_pair.public_key, key_pair.alg)
+    )
+
+    # never keep a key in memory longer than its key pair is valid
+    ttl = (key_pair.exp - datetime.utcnow()).total_seconds()
+    verification_keys.set(kid, key, ttl)
+
+    return key
+
+
+async def get_all_key_pairs(db: AsyncSession) -> list[schemas.KeyPair]:
     """
     get all key pairs from db (valid AND invalid)
     Success: return a list of all KeyPairs
@@ -35,11 +86,11 @@ def get_all_key_pairs(db: Session) -> list[schemas.KeyPair]:
 
     return [
         schemas.KeyPair.from_orm(key_pair)
-        for key_pair in models.KeyPair.get_all(db)
+        for key_pair in await models.KeyPair.get_all(db)
     ]
 
 
-def get_valid_key_pairs(db: Session) -> list[schemas.KeyPair]:
+async def get_valid_key_pairs(db: AsyncSession) -> list[schemas.KeyPair]:
     """
     get all valid key pairs from db
     Success: return a list of all KeyPair
@@ -47,23 +98,107 @@ def get_valid_key_pairs(db: Session) -> list[schemas.KeyPair]:
 
     return [
         schemas.KeyPair.from_orm(key_pair)
-        for key_pair in models.KeyPair.get_valid(db)
+        for key_pair in await models.KeyPair.get_valid(db)
+    ]
+
+
+async def get_signing_key_pairs(db: AsyncSession) -> list[schemas.KeyPair]:
+    """
+    get all key pairs that may sign tokens (not standby, not retired)
+    Success: return a list of all KeyPair
+    """
+
+    return [
+        schemas.KeyPair.from_orm(key_pair)
+        for key_pair in await models.KeyPair.get_signing(
+            RETIRE_GRACE, config.SIGNING_ALGORITHM, db)
     ]
 
 
-def get_random_valid_key_pair(db: Session) -> schemas.KeyPair:
+@metrics.timed('get_random_valid_key_pair')
+async def get_random_valid_key_pair(db: AsyncSession) -> schemas.KeyPair:
     """
-    get a random valid key pair from db
+    get a random key pair that may sign tokens
     Success: returns a random KeyPair
+    (if none exists -> promote a standby key pair or create a new one)
+    """
+
+    keys = await get_signing_key_pairs(db)
+    if len(keys) > 0:
+        return random.choice(keys)
+
+    # use key pair already published in JWKS
+    standby = await models.KeyPair.get_standby(config.SIGNING_ALGORITHM, db)
+    if len(standby) > 0:
+        return await promote_key_pair(standby[0], db)
+
+    # should not happen while rotation service runs
+    logger.warning('No KeyPair found. Creating a new one...')
+    return await add_key_pair(db)
+
+
+async def get_signing_key(db: AsyncSession) -> SigningKey:
+    """
+    get a random valid signing key (parsed private key)
+    only hits the db if the keys were changed or are outdated
+    Success: returns a random SigningKey
     (if no key pair exists -> create a new one and return it)
     """
 
-    keys = get_valid_key_pairs(db)
-    if len(keys) == 0:
-        logger.debug('No KeyPair found. Creating a new one...')
-        # if no key pair exists -> create key pair and return it
-        return create_key_pair(db)
-    return random.choice(keys)
+    key = None if signing_keys.stale else signing_keys.choose()
+
+    result = 'miss' if key is None else 'hit'
+    metrics.cache_requests.inc('signing_keys', result)
+
+    if key is None:
+        # (re)load key pairs that may sign
+        key_pairs = await get_signing_key_pairs(db)
+        if len(key_pairs) == 0:
+            key_pairs = [await get_random_valid_key_pair(db)]
+        signing_keys.load(key_pairs)
+        key = signing_keys.choose()
+
+    return key
+
+
+async def get_jwks(db: AsyncSession) -> tuple[bytes, str]:
+    """
+    get json web key set of all valid key pairs
+    only hits the db if the key pairs were changed or the set is outdated
+    Success: returns serialized JWKS and its ETag
+    """
+
+    document = jwks_documents.get('jwks')
+    if document is not None:
+        return document
+
+    jwks = []
+
+    # iterate over valid key pairs and construct jwk for every pair
+    for key_pair in await get_valid_key_pairs(db):
+
+        public_key = jwk.construct(key_pair.public_key, key_pair.alg)
+        # set key id (kid) and create schema
+        key = schemas.JWK(**public_key.to_dict(), kid=key_pair.kid)
+        jwks.append(key)
+
+    # leave out parameters of other key types
+    body = schemas.JWKS(keys=jwks).json(exclude_none=True).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()}"'
+
+    document = (body, etag)
+    jwks_documents.set('jwks', document)
+    return document
+
+
+def clear_key_caches() -> None:
+    """
+    drops all parsed keys held in memory
+    needed after key pairs were changed without the functions below
+    """
+    verification_keys.clear()
+    signing_keys.invalidate()
+    jwks_documents.clear()
 
 
 def calculate_token_exp():
@@ -76,45 +211,38 @@ def calculate_token_exp():
     return (now+expires_in-epoch).total_seconds()
 
 
-def create_key_pair(db: Session) -> schemas.KeyPair:
+async def create_key_pair(db: AsyncSession) -> schemas.KeyPair:
     """
-    Generates a new rsa key pair and saves it to db
-    Success: returns a new KeyPair
+    makes sure there is a key pair that may sign tokens
+    Success: returns existing or new KeyPair
     """
 
-    # seach if there are valid key pairs in db
-    valid_key_pairs = get_valid_key_pairs(db)
+    # seach if there are signing key pairs in db
+    signing_key_pairs = await get_signing_key_pairs(db)
 
     # if there are -> return first result
-    if len(valid_key_pairs) > 0:
-        return valid_key_pairs[0]
+    if len(signing_key_pairs) > 0:
+        return signing_key_pairs[0]
 
     # else start generating a new key pair
+    return await add_key_pair(db)
 
-    PUBLIC_EXPONENT = 65537
-    KEY_SIZE = 2048
 
-    # generate private/secret key
-    private_key = rsa.generate_private_key(
-        public_exponent=PUBLIC_EXPONENT,
-        key_size=KEY_SIZE,
-    )
-
-    # save private/secret key as PEM
-    private_key_pem = private_key.private_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.PKCS8,
-        encryption_algorithm=serialization.NoEncryption()
-    )
+async def add_key_pair(
+    db: AsyncSession,
+    standby: bool = False
+) -> schemas.KeyPair:
+    """
+    Generates a new key pair (SIGNING_ALGORITHM) and saves it to db
+    standby key pairs are published in JWKS, but do not sign yet
+    Success: returns a new KeyPair
+    """
 
-    # generate public key
-    public_key = private_key.public_key()
+    alg = config.SIGNING_ALGORITHM
 
-    # save public key as PEM
-    public_key_pem = public_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    )
+    # generate keys in a thread, so requests are not blocked meanwhile
+    private_key_pem, public_key_pem = await asyncio.to_thread(
+        generate_key_pair, alg)
 
     # calculate expire date
     exp = datetime.utcnow() + timedelta(days=config.KEY_PAIR_LIFETIME*365)
@@ -122,43 +250,132 @@ def create_key_pair(db: Session) -> schemas.KeyPair:
     # new key pair schema with kid and expire date
     key_pair = schemas.KeyPair(
         kid=secrets.token_urlsafe(),
+        alg=alg,
         private_key=private_key_pem,
         public_key=public_key_pem,
-        exp=exp
+        exp=exp,
+        standby=standby
     )
 
     # save new key pair to db
-    key_pair: schemas.KeyPair = models.KeyPair.create(key_pair, db)
+    key_pair: schemas.KeyPair = await models.KeyPair.create(key_pair, db)
+
+    # drop cached keys, next validation/signing picks up the new state
+    clear_key_caches()
 
     logger.debug(f'KeyPair {key_pair.kid} was successfuly created')
 
     return key_pair
 
 
-def delete_key_pair(kid: str, db: Session) -> schemas.KeyPair:
+async def promote_key_pair(
+    key_pair: models.KeyPair,
+    db: AsyncSession
+) -> schemas.KeyPair:
+    """
+    starts using given standby key pair for signing tokens
+    Success: returns promoted KeyPair
+    """
+
+    key_pair.standby = False
+
+    # commit local changes to database
+    await db.commit()
+
+    # signing keys have to be reloaded
+    signing_keys.invalidate()
+
+    logger.info(f'KeyPair {key_pair.kid} was promoted from standby')
+
+    return schemas.KeyPair.from_orm(key_pair)
+
+
+async def rotate_key_pairs(db: AsyncSession) -> None:
+    """
+    keeps key pairs rotated, runs in the background (see utils/rotation.py)
+    - promotes the standby key pair before the signing key pairs retire
+    - creates a new standby key pair, so it is in the JWKS ahead of use
+    - deletes key pairs after they expired (grace period is over)
+    """
+
+    now = datetime.utcnow()
+    lead = timedelta(days=config.KEY_ROTATION_LEAD)
+    # standby keys have to be published this long before they sign
+    published_before = now - timedelta(seconds=config.JWKS_MAX_AGE)
+
+    alg = config.SIGNING_ALGORITHM
+    signing = await models.KeyPair.get_signing(RETIRE_GRACE, alg, db)
+    standby = await models.KeyPair.get_standby(alg, db)
+
+    retire_soon = all(
+        key_pair.exp - RETIRE_GRACE - lead <= now for key_pair in signing)
+
+    if retire_soon:
+        published = [
+            key_pair for key_pair in standby
+            if key_pair.added_at <= published_before
+        ]
+        if len(signing) == 0 and len(published) == 0:
+            # nothing left to sign -> use any standby key pair
+            published = standby
+        if len(published) > 0:
+            await promote_key_pair(published[0], db)
+            standby.remove(published[0])
+            signing.append(published[0])
+
+    if len(signing) == 0:
+        await add_key_pair(db)
+
+    if len(standby) == 0:
+        await add_key_pair(db, standby=True)
+
+    # retire key pairs whose tokens all expired and
+    # standby key pairs of an algorithm no longer in use (never signed)
+    stmt = delete(models.KeyPair).where(
+        (models.KeyPair.exp <= now) | (
+            (models.KeyPair.standby == true()) & (models.KeyPair.alg != alg)
+        )
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+
+    if result.rowcount > 0:
+        clear_key_caches()
+        logger.info(f'{result.rowcount} KeyPairs were retired and deleted')
+
+
+async def delete_key_pair(kid: str, db: AsyncSession) -> schemas.KeyPair:
     """
     delete existing keypair in db by kid
+    caches of other workers keep the key pair until they expire
+    (KEY_CACHE_TTL, SIGNING_KEY_REFRESH, JWKS_CACHE_TTL)
     Success: return KeyPair
     Failure (kid not in db): raise EntityDoesNotExistException
     """
 
     # try to get keypair that shall be deleted
     # raises 404 Not Found if no keypair was found
-    key_pair = get_key_pair(kid, db)
+    key_pair = await get_key_pair(kid, db)
 
     # create delete query
     stmt = delete(models.KeyPair).where(models.KeyPair.kid == kid)
 
     # execute update query locally
-    db.execute(stmt)
+    await db.execute(stmt)
 
     # commit local changes to database
-    db.commit()
+    await db.commit()
+
+    # deleted key must not be used for validation or signing anymore
+    # nor be published in the JWKS (caches of this worker only)
+    verification_keys.pop(kid)
+    signing_keys.invalidate()
+    jwks_documents.clear()
 
     logger.debug(f'KeyPair {key_pair.kid} was successfuly deleted')
 
-    # to make sure there is always a valid key pair
-    # get random VALID key pair (generates a new one if no valid one is found)
-    get_random_valid_key_pair(db)
+    # to make sure there is always a key pair that may sign
+    # (promotes standby key pair, rotation creates a new standby one)
+    await get_random_valid_key_pair(db)
 
     return key_pair
@@ -0,0 +1,89 @@
+from datetime import datetime
+from time import time
+from typing import AsyncIterator
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import config, logger, models, schemas
+from ..utils.cache import TTLCache
+
+# jtis revoked through this worker, kept until the token expires
+# but at most REVOKED_TOKEN_CACHE_TTL seconds
+revoked_tokens = TTLCache(
+    config.REVOKED_TOKEN_CACHE_SIZE,
+    config.REVOKED_TOKEN_CACHE_TTL,
+    name='revoked_tokens'
+)
+
+
+async def revoke_token(token: schemas.Token, db: AsyncSession) -> None:
+    """
+    adds jti of given (validated) token to the revoked tokens in db
+    Success: returns None (also if the token was revoked before)
+    """
+
+    db.add(models.RevokedToken(
+        jti=token.jti,
+        exp=datetime.utcfromtimestamp(token.exp),
+        revoked_at=datetime.utcnow()
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # revoked before
+        await db.rollback()
+        return
+
+    revoked_tokens.set(token.jti, True, token.exp - time())
+    logger.info(f'Token {token.jti} of {token.sub} was revoked')
+
+
+async def is_token_revoked(jti: uuid.UUID, db: AsyncSession) -> bool:
+    """
+    checks if token with given jti was revoked (exact, db lookup)
+    Success: returns True if revoked, False otherwise
+    """
+
+    if revoked_tokens.get(jti) is not None:
+        return True
+
+    return await models.RevokedToken.is_revoked(jti, db)
+
+
+async def get_revoked_jtis_since(
+    since: datetime,
+    db: AsyncSession
+) -> list[uuid.UUID]:
+    """
+    get jtis of tokens revoked since given time (utc) that did not expire
+    Success: returns list of jtis
+    """
+
+    return await models.RevokedToken.get_jtis_since(since, db)
+
+
+async def stream_revoked_jtis(
+    batch_size: int,
+    db: AsyncSession
+) -> AsyncIterator[list[uuid.UUID]]:
+    """
+    get jtis of all revoked tokens that did not expire in batches
+    Success: yields lists of jtis
+    """
+
+    async for batch in models.RevokedToken.stream_jtis(batch_size, db):
+        yield batch
+
+
+async def delete_expired_revoked_tokens(db: AsyncSession) -> int:
+    """
+    deletes revoked tokens that expired (rejected by exp anyway)
+    Success: returns number of deleted rows
+    """
+
+    deleted = await models.RevokedToken.delete_expired(db)
+    if deleted > 0:
+        logger.info(f'{deleted} expired revoked tokens were deleted')
+    return deleted
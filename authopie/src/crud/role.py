@@ -1,12 +1,19 @@
-from sqlalchemy.orm import Session
+import uuid
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import delete, select
 
 from .. import logger, models, schemas
 from ..exceptions import (EntityAlreadyExistsException,
                           EntityDoesNotExistException)
+from ..exceptions import InvalidCursorException
+from ..utils import pagination, scopes
+from .cache import principals, token_versions
+from .scope import delete_role_scopes, sync_role_scopes
 
 
-def get_role(name: str, db: Session) -> schemas.RoleInDB:
+async def get_role(name: str, db: AsyncSession) -> schemas.RoleInDB:
     """
     get role from db by name
     Success: return RoleInDB
@@ -14,7 +21,7 @@ def get_role(name: str, db: Session) -> schemas.RoleInDB:
     """
 
     # find role by name
-    role: models.Role = models.Role.get_by_name(name, db)
+    role: models.Role = await models.Role.get_by_name(name, db)
 
     # check if any entries were found
     if role is None:
@@ -24,7 +31,7 @@ def get_role(name: str, db: Session) -> schemas.RoleInDB:
     return schemas.RoleInDB.from_orm(role)
 
 
-def get_all_roles(db: Session) -> list[schemas.RoleInDB]:
+async def get_all_roles(db: AsyncSession) -> list[schemas.RoleInDB]:
     """
     get all roles from db
     Success: return a list of all RoleInDB
@@ -32,11 +39,63 @@ def get_all_roles(db: Session) -> list[schemas.RoleInDB]:
 
     return [
         schemas.RoleInDB.from_orm(role)
-        for role in models.Role.get_all(db)
+        for role in await models.Role.get_all(db)
     ]
 
 
-def create_role(role_in: schemas.RoleIn, db: Session) -> schemas.RoleInDB:
+async def get_roles_page(
+    limit: int,
+    cursor: str | None,
+    prefix: str | None,
+    scope: str | None,
+    db: AsyncSession
+) -> tuple[list[schemas.RoleInDB], str | None]:
+    """
+    get one page of roles ordered by name
+    - cursor: next_cursor of the previous page (None -> first page)
+    - prefix: only roles whose name starts with prefix
+    - scope: only roles granting this scope
+    Success: return RoleInDB of the page and cursor of the next page
+      (None if this is the last page)
+    Failure (malformed cursor): raise InvalidCursorException
+    """
+
+    after = None
+    if cursor is not None:
+        name, role_id = pagination.decode_cursor(cursor, 2)
+        try:
+            after = (name, uuid.UUID(role_id))
+        except ValueError:
+            raise InvalidCursorException()
+
+    # one extra row tells if there is a next page
+    roles = await models.Role.get_page(limit + 1, after, prefix, scope, db)
+
+    next_cursor = None
+    if len(roles) > limit:
+        roles = roles[:limit]
+        next_cursor = pagination.encode_cursor(roles[-1].name, roles[-1].id)
+
+    return [schemas.RoleInDB.from_orm(role) for role in roles], next_cursor
+
+
+async def stream_roles(
+    batch_size: int,
+    db: AsyncSession
+) -> AsyncIterator[list[schemas.RoleInDB]]:
+    """
+    get all roles from db in batches (server side cursor)
+    Success: yields lists of RoleInDB
+    """
+
+    async for batch in models.Role.stream_all(batch_size, db):
+        yield [schemas.RoleInDB.from_orm(role) for role in batch]
+
+
+async def create_role(
+    role_in: schemas.RoleIn,
+    db: AsyncSession
+) -> schemas.RoleInDB:
     """
     create new role in db from schema RoleIn (name, scopes)
     Success: return RoleInDB
@@ -45,7 +104,7 @@ def create_role(role_in: schemas.RoleIn, db: Session) -> schemas.RoleInDB:
 
     # search for given role name in db
     stmt = select(models.Role).where(models.Role.name == role_in.name)
-    role = db.execute(stmt).scalars().first()
+    role = (await db.execute(stmt)).scalars().first()
 
     if role is not None:
         # role already exists
@@ -54,15 +113,24 @@ def create_role(role_in: schemas.RoleIn, db: Session) -> schemas.RoleInDB:
     # create Role schema
     new_role = schemas.RoleInDB(**role_in.dict())
 
+    # compile scopes once, tokens of its users reuse them
+    scopes.compile_scopes(new_role.scopes)
+
+    # role and its scope catalog rows (reverse lookups) in one commit
+    db.add(models.Role(**new_role.dict()))
+    await db.flush()
+    await sync_role_scopes(new_role.id, new_role.scopes, db)
+    await db.commit()
+
     logger.debug(f'Role {new_role.name} was successfuly created')
 
-    return models.Role.create(new_role, db)
+    return new_role
 
 
-def update_role(
+async def update_role(
     name: str,
     role_update: schemas.RoleInUpdate,
-    db: Session
+    db: AsyncSession
 ) -> schemas.RoleInDB:
     """
     update existing role in db from RoleInUpdate (name, scopes)
@@ -71,7 +139,7 @@ def update_role(
     """
 
     # check if role exists
-    db_role = models.Role.get_by_name(name, db)
+    db_role = await models.Role.get_by_name(name, db)
 
     if db_role is None:
         # role not found -> raise 404 Not Found
@@ -80,28 +148,49 @@ def update_role(
     if role_update.name is not None:
         try:
             # check for role with new updated name
-            get_role(role_update.name, db)
+            await get_role(role_update.name, db)
             # role with name already exists
             raise EntityAlreadyExistsException('Role')
         except EntityDoesNotExistException:
             # update name in model
             db_role.name = role_update.name
 
-    if role_update.scopes is not None:
+    if role_update.scopes is not None and role_update.scopes != db_role.scopes:
         # update scopes in model
         db_role.scopes = role_update.scopes
+        # tokens of users with this role carry the old scopes
+        await bump_token_versions(db_role.id, db)
+        await sync_role_scopes(db_role.id, db_role.scopes, db)
 
     # commit local changes to database
-    db.commit()
+    await db.commit()
     # refresh local role by pulling from database
-    db.refresh(db_role)
+    await db.refresh(db_role)
+
+    # compile new scopes once, tokens of its users reuse them
+    scopes.compile_scopes(db_role.scopes)
+
+    # cached users may carry the old role
+    principals.clear()
+    token_versions.clear()
 
     logger.debug(f'Role {db_role.name} was successfuly updated')
 
     return schemas.RoleInDB.from_orm(db_role)
 
 
-def delete_role(name: str, db: Session) -> schemas.RoleInDB:
+async def bump_token_versions(role_id: uuid.UUID, db: AsyncSession) -> None:
+    """
+    invalidates tokens of all users with given role (not committed)
+    one update, no matter how many users have the role
+    """
+
+    has_role = select(models.UserRole.user_id).where(
+        models.UserRole.role_id == role_id)
+    await models.User.bump_token_version(db, models.User.id.in_(has_role))
+
+
+async def delete_role(name: str, db: AsyncSession) -> schemas.RoleInDB:
     """
     delete existing role in db by name
     Success: return RoleInDB
@@ -110,23 +199,33 @@ def delete_role(name: str, db: Session) -> schemas.RoleInDB:
 
     # try to get role that shall be deleted
     # raises 404 Not Found if no role was found
-    role = get_role(name, db)
+    role = await get_role(name, db)
+
+    # tokens of users with this role carry its scopes
+    await bump_token_versions(role.id, db)
+
+    # delete entries of role in user_role (references role)
+    stmt = delete(models.UserRole).where(
+        models.UserRole.role_id == role.id)
+
+    await db.execute(stmt)
+
+    # scope catalog references role
+    await delete_role_scopes([role.id], db)
 
     # create delete query
     stmt = delete(models.Role).where(
         models.Role.name == name)
 
     # execute update query locally
-    db.execute(stmt)
-
-    # delete entries of role in user_role
-    stmt = delete(models.UserRole).where(
-        models.UserRole.role_id == role.id)
-
-    db.execute(stmt)
+    await db.execute(stmt)
 
     # commit local changes to database
-    db.commit()
+    await db.commit()
+
+    # cached users may carry the deleted role
+    principals.clear()
+    token_versions.clear()
 
     logger.debug(f'Role {role.name} was successfuly deleted')
 
@@ -0,0 +1,145 @@
+import uuid
+from typing import Iterable
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import delete, insert, select
+
+from .. import logger, models
+from ..utils.scopes import compile_scopes
+
+
+async def get_scopes(prefix: str | None, db: AsyncSession) -> list[str]:
+    """
+    get names of all scopes granted by roles (starting with prefix)
+    Success: return list of scope names ordered by name
+    """
+
+    return await models.Scope.get_names(prefix, db)
+
+
+async def get_scope_ids(
+    names: Iterable[str],
+    db: AsyncSession
+) -> dict[str, uuid.UUID]:
+    """
+    get ids of scopes by name, missing scopes are created (not committed)
+    Success: return dict scope name -> id
+    """
+
+    names = set(names)
+    stmt = select(models.Scope.name, models.Scope.id).where(
+        models.Scope.name.in_(names))
+    ids = dict((await db.execute(stmt)).all())
+
+    missing = [
+        dict(id=uuid.uuid4(), name=name) for name in names - ids.keys()]
+    if len(missing) > 0:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(models.Scope), missing)
+            ids.update((row['name'], row['id']) for row in missing)
+        except IntegrityError:
+            # created meanwhile by another request -> load them
+            ids = dict((await db.execute(stmt)).all())
+
+    return ids
+
+
+async def delete_orphan_scopes(db: AsyncSession) -> None:
+    """ deletes scopes no role grants anymore (not committed) """
+
+    used = select(models.RoleScope.scope_id).where(
+        models.RoleScope.scope_id == models.Scope.id)
+    await db.execute(delete(models.Scope).where(~used.exists()))
+
+
+async def sync_role_scopes(
+    role_id: uuid.UUID,
+    scopes: str | None,
+    db: AsyncSession
+) -> None:
+    """
+    makes role_scope of role match its scopes string (not committed)
+    only added/removed scopes are written
+    """
+
+    names = compile_scopes(scopes)
+
+    stmt = (
+        select(models.Scope.name, models.RoleScope.scope_id)
+        .join(models.Scope, models.Scope.id == models.RoleScope.scope_id)
+        .where(models.RoleScope.role_id == role_id)
+    )
+    current = dict((await db.execute(stmt)).all())
+
+    removed = [current[name] for name in current.keys() - names]
+    if len(removed) > 0:
+        await db.execute(delete(models.RoleScope).where(
+            models.RoleScope.role_id == role_id,
+            models.RoleScope.scope_id.in_(removed)
+        ))
+        await delete_orphan_scopes(db)
+
+    added = names - current.keys()
+    if len(added) > 0:
+        ids = await get_scope_ids(added, db)
+        await db.execute(insert(models.RoleScope), [
+            dict(role_id=role_id, scope_id=ids[name]) for name in added])
+
+
+async def delete_role_scopes(
+    role_ids: list[uuid.UUID],
+    db: AsyncSession
+) -> None:
+    """ deletes role_scope of given roles (not committed) """
+
+    await db.execute(delete(models.RoleScope).where(
+        models.RoleScope.role_id.in_(role_ids)))
+    await delete_orphan_scopes(db)
+
+
+async def rebuild_scope_catalog(db: AsyncSession) -> None:
+    """
+    makes scope and role_scope match role.scopes of all roles
+    (not committed), only differences are written
+    """
+
+    roles = (await db.execute(
+        select(models.Role.id, models.Role.scopes))).all()
+
+    stmt = (
+        select(models.RoleScope.role_id, models.Scope.name)
+        .join(models.Scope, models.Scope.id == models.RoleScope.scope_id)
+    )
+    current: dict[uuid.UUID, set[str]] = {}
+    for role_id, name in await db.execute(stmt):
+        current.setdefault(role_id, set()).add(name)
+
+    # role_scope rows of roles that do not exist anymore
+    role_ids = {role_id for role_id, _ in roles}
+    stale = [role_id for role_id in current if role_id not in role_ids]
+    if len(stale) > 0:
+        await db.execute(delete(models.RoleScope).where(
+            models.RoleScope.role_id.in_(stale)))
+
+    synced = 0
+    for role_id, scopes in roles:
+        if compile_scopes(scopes) != current.get(role_id, set()):
+            await sync_role_scopes(role_id, scopes, db)
+            synced += 1
+
+    await delete_orphan_scopes(db)
+
+    if synced > 0 or len(stale) > 0:
+        logger.info(f'Scope catalog updated for {synced} roles')
+
+
+async def backfill_scope_catalog(db: AsyncSession) -> None:
+    """
+    fills scope and role_scope from role.scopes (on startup)
+    catches up on roles written by older versions or other tools
+    """
+
+    await rebuild_scope_catalog(db)
+    await db.commit()
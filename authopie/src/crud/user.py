@@ -1,16 +1,20 @@
-from sqlalchemy.orm import Session
+import uuid
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import delete
 
 from .. import logger, models, schemas
 from ..exceptions import (EntityAlreadyExistsException,
                           EntityDoesNotExistException,
                           IncorrectCredentialsException)
-from ..utils import pwdhash
+from ..utils import pagination, pwdhash
 from ..utils.constants import Password, Username
+from .cache import principals, token_versions
 from .role import get_role
 
 
-def get_user(username: Username, db: Session) -> schemas.UserInDB:
+async def get_user(username: Username, db: AsyncSession) -> schemas.UserInDB:
     """
     get user from db by username
     Success: return UserInDB
@@ -18,18 +22,91 @@ def get_user(username: Username, db: Session) -> schemas.UserInDB:
     """
 
     # find user by username
-    user: models.User = models.User.get_by_username(username, db)
+    user: models.User = await models.User.get_by_username(username, db)
 
     # check if any entries were found
     if user is None:
-        logger.debug(f'User {username} does not exist in db!')
+        logger.debug('User %s does not exist in db!', username)
         # no db entries found -> raise 404 Not Found
         raise EntityDoesNotExistException('User')
 
     return schemas.UserInDB.from_orm(user)
 
 
-def get_all_users(db: Session) -> list[schemas.UserInDB]:
+async def get_principal(
+    username: Username,
+    db: AsyncSession
+) -> schemas.UserInDB:
+    """
+    get user from cache or db by username, used for token auth
+    Success: return UserInDB
+    Failure (no user with username): raise EntityDoesNotExistException
+    """
+
+    user = principals.get(username)
+
+    if user is None:
+        # not cached (or outdated) -> load user and roles from db
+        user = await get_user(username, db)
+        principals.set(username, user)
+
+    return user
+
+
+def clear_principals() -> None:
+    """
+    drops all cached users
+    needed after users were changed without the functions below
+    """
+    principals.clear()
+
+
+async def get_token_version(
+    username: Username,
+    db: AsyncSession
+) -> tuple[uuid.UUID, int]:
+    """
+    get id and token version of user from cache or db by username
+    Success: return (id, token version)
+    Failure (no user with username): raise EntityDoesNotExistException
+    """
+
+    # (None, None) is cached for unknown users, get returns None on a miss
+    entry = token_versions.get(username)
+
+    if entry is None:
+        entry = await models.User.get_token_version(username, db)
+        entry = entry or (None, None)
+        token_versions.set(username, entry)
+
+    if entry[0] is None:
+        raise EntityDoesNotExistException('User')
+
+    return entry
+
+
+async def invalidate_tokens(username: Username, db: AsyncSession) -> None:
+    """
+    invalidates all tokens of user (log out everywhere)
+    by incrementing its token version, one row update
+    Success: returns None
+    Failure (username not in db): raise EntityDoesNotExistException
+    """
+
+    if await models.User.bump_token_version(
+            db, models.User.username == username) == 0:
+        raise EntityDoesNotExistException('User')
+
+    await db.commit()
+
+    # drop cached user
+    principals.pop(username)
+    token_versions.pop(username)
+
+    logger.info(f'All tokens of user {username} were invalidated')
+
+
+async def get_all_users(db: AsyncSession) -> list[schemas.UserInDB]:
     """
     get all users from db
     Success: return a list of all UserInDB
@@ -37,11 +114,63 @@ def get_all_users(db: Session) -> list[schemas.UserInDB]:
 
     return [
         schemas.UserInDB.from_orm(user)
-        for user in models.User.get_all(db)
+        for user in await models.User.get_all(db)
     ]
 
 
-def create_user(user: schemas.UserIn, db: Session) -> schemas.UserInDB:
+async def get_users_page(
+    limit: int,
+    cursor: str | None,
+    prefix: str | None,
+    role: str | None,
+    scope: str | None,
+    db: AsyncSession
+) -> tuple[list[schemas.UserInDB], str | None]:
+    """
+    get one page of users ordered by username
+    - cursor: next_cursor of the previous page (None -> first page)
+    - prefix: only users whose username starts with prefix
+    - role: only users having the role with this name
+    - scope: only users granted this scope by one of their roles
+    Success: return UserInDB of the page and cursor of the next page
+      (None if this is the last page)
+    Failure (malformed cursor): raise InvalidCursorException
+    """
+
+    after = None
+    if cursor is not None:
+        after, = pagination.decode_cursor(cursor, 1)
+
+    # one extra row tells if there is a next page
+    users = await models.User.get_page(
+        limit + 1, after, prefix, role, scope, db)
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = pagination.encode_cursor(users[-1].username)
+
+    return [schemas.UserInDB.from_orm(user) for user in users], next_cursor
+
+
+async def stream_users(
+    batch_size: int,
+    db: AsyncSession
+) -> AsyncIterator[list[schemas.UserInDB]]:
+    """
+    get all users from db in batches (server side cursor)
+    memory stays flat, no matter how many users there are
+    Success: yields lists of UserInDB
+    """
+
+    async for batch in models.User.stream_all(batch_size, db):
+        yield [schemas.UserInDB.from_orm(user) for user in batch]
+
+
+async def create_user(
+    user: schemas.UserIn,
+    db: AsyncSession
+) -> schemas.UserInDB:
     """
     create new user in db from schema UserIn (username, password, roles)
     Success: return UserInDB
@@ -52,7 +181,7 @@ def create_user(user: schemas.UserIn, db: Session) -> schemas.UserInDB:
     # TODO this is really clunky
     # maybe get_user with option not to throw exception and instead return None
     try:
-        get_user(user.username, db)
+        await get_user(user.username, db)
         raise EntityAlreadyExistsException('User')
     except EntityDoesNotExistException:
         pass
@@ -62,11 +191,11 @@ def create_user(user: schemas.UserIn, db: Session) -> schemas.UserInDB:
 
     # check if all given roles exist (raises 404 Not Found)
     for role_name in user.roles:
-        role = get_role(role_name, db)
+        role = await get_role(role_name, db)
         roles.append(role)
 
     # create password key
-    hpwd = pwdhash.get_password_hash(user.password)
+    hpwd = await pwdhash.get_password_hash_async(user.password)
 
     # create User schema
     new_user = schemas.UserInDB(
@@ -75,15 +204,21 @@ def create_user(user: schemas.UserIn, db: Session) -> schemas.UserInDB:
         roles=roles
     )
 
+    created_user = await models.User.create(new_user, db)
+
+    # the username may be cached as unknown (e.g. deleted before)
+    principals.pop(new_user.username)
+    token_versions.pop(new_user.username)
+
     logger.debug(f'User {new_user.username} was successfuly created')
 
-    return models.User.create(new_user, db)
+    return created_user
 
 
-def update_user(
+async def update_user(
     username: Username,
     user_update: schemas.UserInUpdate,
-    db: Session
+    db: AsyncSession
 ) -> schemas.UserInDB:
     """
     update existing user in db from UserInUpdate (username, password, roles)
@@ -92,7 +227,7 @@ def update_user(
     """
 
     # check if user exists
-    db_user = models.User.get_by_username(username, db)
+    db_user = await models.User.get_by_username(username, db)
 
     if db_user is None:
         # user not found -> raise 404 Not Found
@@ -101,7 +236,7 @@ def update_user(
     if user_update.username is not None:
         try:
             # check for user with new updated username
-            get_user(user_update.username, db)
+            await get_user(user_update.username, db)
             # user with username already exists
             raise EntityAlreadyExistsException('User')
         except EntityDoesNotExistException:
@@ -110,24 +245,38 @@ def update_user(
 
     if user_update.password is not None:
         # create password key and update it in model
-        db_user.hashed_password = pwdhash.get_password_hash(
+        db_user.hashed_password = await pwdhash.get_password_hash_async(
             user_update.password)
 
     # update user role table
     if user_update.roles is not None and len(user_update.roles) > 0:
-        update_user_role(db_user, user_update.roles, db)
+        await update_user_role(db_user, user_update.roles, db)
+
+    if user_update.password is not None or user_update.roles:
+        # tokens issued before carry the old password / scopes
+        db_user.token_version = models.User.token_version + 1
 
     # commit local changes to database
-    db.commit()
+    await db.commit()
     # refresh local user by pulling from database
-    db.refresh(db_user)
+    await db.refresh(db_user)
+
+    # drop cached user (old and new username)
+    principals.pop(username)
+    principals.pop(db_user.username)
+    token_versions.pop(username)
+    token_versions.pop(db_user.username)
 
     logger.debug(f'User {db_user.username} was successfuly updated')
 
     return schemas.UserInDB.from_orm(db_user)
 
 
-def update_user_role(db_user: models.User, new_roles: list[str], db: Session):
+async def update_user_role(
+    db_user: models.User,
+    new_roles: list[str],
+    db: AsyncSession
+):
     """
     takes a list of roles (str) and
     assigns them to given user in user_role table
@@ -138,13 +287,13 @@ def update_user_role(db_user: models.User, new_roles: list[str], db: Session):
 
     # check if all given roles exist (raises 404 Not Found)
     for role_name in new_roles:
-        role = get_role(role_name, db)
+        role = await get_role(role_name, db)
         roles.append(role)
 
     # delete all user_roles for given user
     stmt = delete(models.UserRole).where(
         models.UserRole.user_id == db_user.id)
-    db.execute(stmt)
+    await db.execute(stmt)
 
     # recreate user_roles with new roles
     for role in roles:
@@ -153,7 +302,10 @@ def update_user_role(db_user: models.User, new_roles: list[str], db: Session):
         db.add(db_user_role)
 
 
-def delete_user(username: Username, db: Session) -> schemas.UserInDB:
+async def delete_user(
+    username: Username,
+    db: AsyncSession
+) -> schemas.UserInDB:
     """
     delete existing user in db by username
     Success: return UserInDB
@@ -162,34 +314,38 @@ def delete_user(username: Username, db: Session) -> schemas.UserInDB:
 
     # try to get user that shall be deleted
     # raises 404 Not Found if no user was found
-    user = get_user(username, db)
+    user = await get_user(username, db)
 
-    # create delete query
-    stmt = delete(models.User).where(
-        models.User.username == username)
+    # delete entries of user in user_role (references user)
+    stmt = delete(models.UserRole).where(
+        models.UserRole.user_id == user.id)
 
     # execute update query locally
-    db.execute(stmt)
+    await db.execute(stmt)
 
-    # delete entries of user in user_role
-    stmt = delete(models.UserRole).where(
-        models.UserRole.user_id == user.id)
+    # create delete query
+    stmt = delete(models.User).where(
+        models.User.username == username)
 
     # execute update query locally
-    db.execute(stmt)
+    await db.execute(stmt)
 
     # commit local changes to database
-    db.commit()
+    await db.commit()
+
+    # drop cached user
+    principals.pop(username)
+    token_versions.pop(username)
 
     logger.debug(f'User {user.username} was successfuly deleted')
 
     return user
 
 
-def authenticate_user(
+async def authenticate_user(
     username: Username,
     password: Password,
-    db: Session
+    db: AsyncSession
 ) -> schemas.UserInDB:
     """
     compares given username and password to db
@@ -201,15 +357,15 @@ def authenticate_user(
     # get user by username
     try:
         # raises 404 Not Found, if no user with given username exists in db
-        user = get_user(username, db)
+        user = await get_user(username, db)
     except EntityDoesNotExistException:
         # wrong username -> raise 401 Unauthorized
         raise IncorrectCredentialsException
 
-    if not pwdhash.verify_password(password, user.hashed_password):
+    if not await pwdhash.verify_password_async(password, user.hashed_password):
         # wrong password for given username
         raise IncorrectCredentialsException
 
     # user found, correct password
-    logger.debug(f'User {username} found. Correct Password')
+    logger.debug('User %s found. Correct Password', username)
     return user
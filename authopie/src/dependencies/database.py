@@ -4,35 +4,137 @@ Mixin for creating database elements,
 get connection to database
 """
 
-from sqlalchemy import create_engine
+import asyncio
+import fcntl
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator
+
 import sqlalchemy
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
+                                    create_async_engine)
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.sql import select
 
 from .. import config, schemas, logger
 from ..exceptions import TypeException
+from ..utils import metrics
 
 # Docs: https://fastapi.tiangolo.com/tutorial/sql-databases/
+# Docs: https://docs.sqlalchemy.org/en/20/orm/extensions/asyncio.html
+
+# asyncio drivers used for the supported databases
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# key of the postgres advisory lock taken while bootstrapping
+BOOTSTRAP_LOCK_ID = 0x617574686f706965  # 'authopie'
+
+
+def get_database_url() -> URL:
+    """
+    returns url of the database with an asyncio driver
+    - DATABASE_URL from config if set (sqlite:// or postgresql://)
+    - otherwise SQLite file at DB_PATH
+    """
+
+    if config.DATABASE_URL is None:
+        return make_url(f'sqlite+aiosqlite:///{config.DB_PATH}')
 
-SQLALCHEMY_DATABASE_URL = f'sqlite:///{config.DB_PATH}'
+    url = make_url(config.DATABASE_URL)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername)
+
+
+SQLALCHEMY_DATABASE_URL = get_database_url()
 
 # Connect to DB by creating engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# connections are pooled and shared between requests
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=config.DB_POOL_TIMEOUT,
+    pool_recycle=config.DB_POOL_RECYCLE,
 )
 
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """ applies SQLite settings from config to every new connection """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}')
+    cursor.execute(f'PRAGMA cache_size={int(config.SQLITE_CACHE_SIZE)}')
+    cursor.execute(f'PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT)}')
+    cursor.close()
+
+
+if engine.dialect.name == 'sqlite':
+    event.listen(engine.sync_engine, 'connect', set_sqlite_pragmas)
+
+
+# start time is kept on the execution context of the statement, so a
+# failing statement leaves nothing behind on the pooled connection
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    if context is not None:
+        context._query_start = perf_counter()
+
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+    start = getattr(context, '_query_start', None)
+    if start is not None:
+        metrics.db_query_seconds.observe(perf_counter() - start)
+
+
+def pool_gauge(name: str, help: str, method: str) -> metrics.Gauge:
+    """ gauge reading the current pool (pool is replaced on dispose) """
+    return metrics.Gauge(name, help, lambda: getattr(engine.pool, method)())
+
+
+# connection pool usage (GET /metrics)
+for gauge in (
+    pool_gauge('authopie_db_pool_size',
+               'Connections kept open by the pool', 'size'),
+    pool_gauge('authopie_db_pool_checked_out',
+               'Connections currently in use', 'checkedout'),
+    pool_gauge('authopie_db_pool_checked_in',
+               'Idle connections in the pool', 'checkedin'),
+    pool_gauge('authopie_db_pool_overflow',
+               'Connections beyond pool size (negative: pool not full)',
+               'overflow'),
+):
+    metrics.registry.register(gauge)
+
+
 # Pool of Sessions the API can use/create (used in depend in main.py)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# objects stay usable after commit, lazy loading is not possible with asyncio
+SessionLocal = async_sessionmaker(
+    bind=engine,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 
 class DBMixin:
 
     @classmethod
-    def create(
+    async def create(
         cls,
         schema: schemas.BaseModel,
-        db: Session
+        db: AsyncSession
     ) -> schemas.BaseModel:
 
         # check for correct schema (only data schema)
@@ -49,9 +151,9 @@ class DBMixin:
             # add db model to local db instance
             db.add(db_model)
             # commit all added models to db
-            db.commit()
+            await db.commit()
             # refresh local model
-            db.refresh(db_model)
+            await db.refresh(db_model)
             # create schema from db model
             return schema.__class__.from_orm(db_model)
         except sqlalchemy.exc.SQLAlchemyError as exc:
@@ -62,24 +164,120 @@ class DBMixin:
             raise exc
 
     @classmethod
-    def get_all(
+    async def get_all(
         cls,
-        db: Session
-    ) -> 'Base':
+        db: AsyncSession
+    ) -> list['Base']:
 
         stmt = select(cls)
-        return db.execute(stmt).scalars().all()
+        return (await db.execute(stmt)).scalars().all()
+
+    @classmethod
+    async def stream_all(
+        cls,
+        batch_size: int,
+        db: AsyncSession
+    ) -> AsyncIterator[list['Base']]:
+
+        # server side cursor, only batch_size rows are held at a time
+        stmt = select(cls).execution_options(yield_per=batch_size)
+        result = await db.stream_scalars(stmt)
+        async for partition in result.partitions():
+            yield partition
 
 
 # Base for Table Abstraction in models.py
 Base = declarative_base()
 
 
-def get() -> Session:
+async def get() -> AsyncIterator[AsyncSession]:
     """ create new database session """
     # Make Instance from SessionManager (create Session)
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db  # return db-session
-    finally:
-        db.close()
+
+
+def add_missing_columns(conn: sqlalchemy.Connection) -> None:
+    """
+    adds columns defined in models.py that are missing in existing tables
+    (databases created by older versions, there are no migrations)
+    new columns have to be nullable or have a server default
+    """
+    inspector = sqlalchemy.inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        present = [col['name'] for col in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(
+                f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'
+            ))
+            logger.info(f'Added column {column.name} to table {table.name}')
+
+
+def add_missing_indexes(conn: sqlalchemy.Connection) -> None:
+    """ creates indexes defined in models.py missing in existing tables """
+    inspector = sqlalchemy.inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        present = {
+            index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in present:
+                continue
+            index.create(conn)
+            logger.info(f'Added index {index.name} to table {table.name}')
+
+
+async def create_all() -> None:
+    """ create all tables defined in models.py (if not present) """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(add_missing_indexes)
+
+
+async def drop_all() -> None:
+    """ drop all tables defined in models.py """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+
+
+@asynccontextmanager
+async def bootstrap_lock() -> AsyncIterator[None]:
+    """
+    lock shared by all processes using the same database
+    makes sure only one worker at a time creates tables, keys and defaults
+    - postgres: advisory lock (works across nodes)
+    - sqlite: file lock next to the db file (works on one machine)
+    """
+
+    if engine.dialect.name == 'postgresql':
+        async with engine.connect() as conn:
+            params = dict(key=BOOTSTRAP_LOCK_ID)
+            await conn.execute(text('SELECT pg_advisory_lock(:key)'), params)
+            try:
+                yield
+            finally:
+                await conn.execute(
+                    text('SELECT pg_advisory_unlock(:key)'), params)
+        return
+
+    database = SQLALCHEMY_DATABASE_URL.database
+    if engine.dialect.name != 'sqlite' or database in (None, '', ':memory:'):
+        # nothing shared between processes
+        yield
+        return
+
+    with open(f'{database}.lock', 'w') as lock_file:
+        # wait for lock without blocking the event loop
+        await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
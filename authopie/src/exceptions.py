@@ -2,6 +2,7 @@ from fastapi import status
 from fastapi.exceptions import HTTPException
 
 from . import logger
+from .utils.metrics import auth_failures
 
 
 class IncorrectCredentialsException(HTTPException):
@@ -9,6 +10,7 @@ class IncorrectCredentialsException(HTTPException):
 
     def __init__(self) -> None:
         """ HTTPException 401 Unauthorized """
+        auth_failures.inc('401', 'credentials')
         super().__init__(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="401 Unauthorized: Could not validate credentials",
@@ -20,6 +22,7 @@ class TokenValidationFailedException(HTTPException):
 
     def __init__(self) -> None:
         """ HTTPException 401 Unauthorized """
+        auth_failures.inc('401', 'token')
         super().__init__(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="401 Unauthorized: Could not validate Token",
@@ -31,6 +34,7 @@ class ActionForbiddenException(HTTPException):
 
     def __init__(self, scope: str) -> None:
         """ HTTPException 403 Forbidden """
+        auth_failures.inc('403', 'scope')
         super().__init__(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f'403 Forbidden: {scope} is needed to perform this action'
@@ -59,6 +63,28 @@ class EntityAlreadyExistsException(HTTPException):
         )
 
 
+class ImportFailedException(HTTPException):
+    """ HTTPException 400 Bad Request """
+
+    def __init__(self, reason: str) -> None:
+        """ HTTPException 400 Bad Request """
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'400 Bad Request: Import failed - {reason}'
+        )
+
+
+class InvalidCursorException(HTTPException):
+    """ HTTPException 400 Bad Request """
+
+    def __init__(self) -> None:
+        """ HTTPException 400 Bad Request """
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='400 Bad Request: Invalid cursor'
+        )
+
+
 class TypeException(Exception):
     """
     Gets raised everytime a method expects a certain type but was given another
@@ -1,10 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import config, crud, logger, schemas
 from .dependencies import database
 from .exceptions import EntityAlreadyExistsException
-from .routers import (docs, import_export, jwks, key_pair, role, token, user)
+from .routers import (docs, import_export, jwks, key_pair, metrics, role,
+                      scope, token, user)
+from .utils.revocation import revocation
+from .utils.rotation import rotation
 
 app = FastAPI(
     root_path=config.ROOT_PATH,
@@ -17,42 +21,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=config.ALLOWED_HEADERS,
+    # cursor of the next page of GET /user and GET /role
+    expose_headers=['X-Next-Cursor'],
 )
 
 app.include_router(token.router)
 app.include_router(user.router)
 app.include_router(role.router)
+app.include_router(scope.router)
 app.include_router(jwks.router)
 app.include_router(key_pair.router)
 app.include_router(import_export.router)
 app.include_router(docs.router)
 
+if config.METRICS_ENABLED:
+    app.include_router(metrics.router)
+
 
 @app.on_event("startup")
 async def startup_event():
 
     logger.debug('StartUp event triggered')
 
-    from .dependencies.database import Base, engine
+    # workers start at the same time -> only one at a time may bootstrap
+    async with database.bootstrap_lock():
+
+        # await database.drop_all()
+        await database.create_all()
+
+        async with database.SessionLocal() as db:
+            await bootstrap(db)
+
+    # keeps a standby key pair ready and retires old key pairs
+    rotation.start()
+
+    # revoked tokens have to be known before requests are served
+    await revocation.load()
+    revocation.start()
 
-    # Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
 
-    db = database.SessionLocal()
+async def bootstrap(db: AsyncSession):
+    """
+    makes sure there is a valid key pair,
+    the default role and the default user
+    and that the scope catalog matches the roles
+    """
 
     # tries to find keys, generates them if not found
-    crud.create_key_pair(db)
+    await crud.create_key_pair(db)
 
     # create authopie-admin role with super powers
     try:
-        default_role = crud.create_role(
+        default_role = await crud.create_role(
             schemas.RoleIn(name=config.DEFAULT_ROLE_NAME, scopes='*'),
             db
         )
         logger.debug('DEFAULT_ROLE created')
     except EntityAlreadyExistsException:
         logger.debug('DEFAULT_ROLE already present in DB')
-        default_role = crud.get_role(config.DEFAULT_ROLE_NAME, db)
+        default_role = await crud.get_role(config.DEFAULT_ROLE_NAME, db)
 
     # create authopie-admin user with role assigned
     try:
@@ -61,9 +88,22 @@ async def startup_event():
             password=config.DEFAULT_USER_PASSWORD,
             roles=[default_role.name]
         )
-        crud.create_user(user, db)
+        await crud.create_user(user, db)
         logger.debug('DEFAULT_USER created')
     except EntityAlreadyExistsException:
         logger.debug('DEFAULT_USER already present in DB')
 
-    db.close()
+    # roles written by older versions have no role_scope rows yet
+    await crud.backfill_scope_catalog(db)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+
+    logger.debug('ShutDown event triggered')
+
+    await rotation.stop()
+    await revocation.stop()
+
+    # close all pooled database connections
+    await database.engine.dispose()
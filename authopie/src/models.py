@@ -1,18 +1,24 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import AsyncIterator
 import uuid
 
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, relationship
 from sqlalchemy.types import CHAR, TypeDecorator
-from sqlalchemy.sql import select
+from sqlalchemy.sql import (and_, delete, false, or_, select, true, tuple_,
+                            update)
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.sql.schema import Column, ForeignKey
-from sqlalchemy.sql.sqltypes import DateTime, String
+from sqlalchemy.sql.sqltypes import Boolean, DateTime, Integer, String
 
 from .exceptions import TypeException
 
 from . import schemas
 from .dependencies.database import Base, DBMixin
 from .utils.constants import Username
+from .utils.pagination import prefix_filter, prefix_index
+from .utils.scopes import SEPARATOR, WILDCARD, granting_scopes
 
 
 class GUID(TypeDecorator):
@@ -34,7 +40,9 @@ class GUID(TypeDecorator):
         if value is None:
             return value
         elif dialect.name == 'postgresql':
-            return str(value)
+            if not isinstance(value, uuid.UUID):
+                return uuid.UUID(str(value))
+            return value
         else:
             if not isinstance(value, uuid.UUID):
                 return "%.32x" % uuid.UUID(value).int
@@ -53,6 +61,8 @@ class GUID(TypeDecorator):
 
 class Role(DBMixin, Base):
     __tablename__ = "role"
+    # GET /role?prefix= on PostgreSQL
+    __table_args__ = (prefix_index('ix_role_name_prefix', 'name'),)
 
     id = Column(GUID, primary_key=True, index=True, nullable=False)
     name = Column(String, index=True, nullable=False)
@@ -62,11 +72,36 @@ class Role(DBMixin, Base):
     users = relationship('User', secondary='user_role', back_populates='roles')
 
     @classmethod
-    def get_by_name(cls, name: str, db: Session) -> 'Role':
+    async def get_by_name(cls, name: str, db: AsyncSession) -> 'Role':
 
         # find user by username
         stmt = select(cls).where(cls.name == name)
-        return db.execute(stmt).scalars().first()
+        return (await db.execute(stmt)).scalars().first()
+
+    @classmethod
+    async def get_page(
+        cls,
+        limit: int,
+        after: tuple[str, uuid.UUID] | None,
+        prefix: str | None,
+        scope: str | None,
+        db: AsyncSession
+    ) -> list['Role']:
+
+        # keyset pagination ordered by name (not unique) and id
+        stmt = select(cls).order_by(cls.name, cls.id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(tuple_(cls.name, cls.id) > after)
+        if prefix:
+            stmt = stmt.where(*prefix_filter(cls.name, prefix))
+        if scope is not None:
+            # uses the indexes on scope.name and role_scope.scope_id
+            stmt = stmt.where(cls.id.in_(
+                select(RoleScope.role_id)
+                .join(Scope, Scope.id == RoleScope.scope_id)
+                .where(Scope.matching(scope))
+            ))
+        return (await db.execute(stmt)).scalars().all()
 
     def __str__(self):
         return str(self.__dict__)
@@ -74,16 +109,31 @@ class Role(DBMixin, Base):
 
 class User(DBMixin, Base):
     __tablename__ = "user"
+    # GET /user?prefix= on PostgreSQL
+    __table_args__ = (prefix_index('ix_user_username_prefix', 'username'),)
 
     id = Column(GUID, primary_key=True, index=True, nullable=False)
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
+    # embedded in tokens (ver), incrementing it invalidates all tokens
+    token_version = Column(Integer, nullable=False, default=0,
+                           server_default='0')
 
     # define a relationship between user and role via table user_role
-    roles = relationship('Role', secondary='user_role', back_populates='users')
+    # roles are always needed with the user -> load them in one extra query
+    roles = relationship(
+        'Role',
+        secondary='user_role',
+        back_populates='users',
+        lazy='selectin'
+    )
 
     @classmethod
-    def create(cls, user: schemas.UserInDB, db: Session) -> schemas.UserInDB:
+    async def create(
+        cls,
+        user: schemas.UserInDB,
+        db: AsyncSession
+    ) -> schemas.UserInDB:
         """
         creates db user with given user schema
         returns user schema from db
@@ -102,16 +152,85 @@ class User(DBMixin, Base):
         db_user = cls(**user.dict(exclude={'roles'}))
         db.add(db_user)
 
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         return schemas.UserInDB.from_orm(db_user)
 
     @classmethod
-    def get_by_username(cls, username: Username, db: Session) -> 'User':
+    async def get_by_username(
+        cls,
+        username: Username,
+        db: AsyncSession
+    ) -> 'User':
+
+        # find user by username, load roles in the same query
+        stmt = (
+            select(cls)
+            .options(joinedload(cls.roles))
+            .where(cls.username == username)
+        )
+        return (await db.execute(stmt)).unique().scalars().first()
 
-        # find user by username
-        stmt = select(cls).where(cls.username == username)
-        return db.execute(stmt).scalars().first()
+    @classmethod
+    async def get_token_version(
+        cls,
+        username: Username,
+        db: AsyncSession
+    ) -> tuple[uuid.UUID, int] | None:
+
+        # find id and token version of user by username (None: no user)
+        stmt = select(cls.id, cls.token_version).where(
+            cls.username == username)
+        row = (await db.execute(stmt)).first()
+        return None if row is None else tuple(row)
+
+    @classmethod
+    async def bump_token_version(cls, db: AsyncSession, *criteria) -> int:
+
+        # invalidates tokens of matching users with one update (no commit)
+        stmt = (
+            update(cls)
+            .where(*criteria)
+            .values(token_version=cls.token_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return (await db.execute(stmt)).rowcount
+
+    @classmethod
+    async def get_page(
+        cls,
+        limit: int,
+        after: str | None,
+        prefix: str | None,
+        role: str | None,
+        scope: str | None,
+        db: AsyncSession
+    ) -> list['User']:
+
+        # keyset pagination ordered by username (unique index),
+        # roles of the page are loaded in one extra query (selectin)
+        stmt = select(cls).order_by(cls.username).limit(limit)
+        if after is not None:
+            stmt = stmt.where(cls.username > after)
+        if prefix:
+            stmt = stmt.where(*prefix_filter(cls.username, prefix))
+        if role is not None:
+            # uses the index on user_role.role_id
+            has_role = (
+                select(UserRole.user_id)
+                .join(Role, Role.id == UserRole.role_id)
+                .where(UserRole.user_id == cls.id, Role.name == role)
+            )
+            stmt = stmt.where(has_role.exists())
+        if scope is not None:
+            # roles granting scope (indexed) -> their users
+            stmt = stmt.where(cls.id.in_(
+                select(UserRole.user_id)
+                .join(RoleScope, RoleScope.role_id == UserRole.role_id)
+                .join(Scope, Scope.id == RoleScope.scope_id)
+                .where(Scope.matching(scope))
+            ))
+        return (await db.execute(stmt)).scalars().all()
 
     def __str__(self):
         return str(self.__dict__)
@@ -127,7 +246,9 @@ class UserRole(DBMixin, Base):
     role_id = Column(
         GUID, ForeignKey("role.id"),
         nullable=False,
-        primary_key=True
+        primary_key=True,
+        # primary key (user_id, role_id) does not help lookups by role
+        index=True
     )
 
 
@@ -141,23 +262,181 @@ class KeyPair(DBMixin, Base):
     # public key
     private_key = Column(String, nullable=False)
     # expire date
-    exp = Column(String, nullable=False)
+    exp = Column(DateTime, nullable=False)
     # added
     added_at = Column(DateTime, nullable=False)
+    # published in JWKS, but not used for signing yet
+    standby = Column(Boolean, nullable=False, default=False,
+                     server_default=false())
+    # signing algorithm (RS256, ES256, EdDSA)
+    alg = Column(String, nullable=False, default='RS256',
+                 server_default='RS256')
 
     @classmethod
-    def get_by_kid(cls, kid: str, db: Session) -> 'KeyPair':
+    async def get_by_kid(cls, kid: str, db: AsyncSession) -> 'KeyPair':
 
         # find key pair by kid
         stmt = select(cls).where(cls.kid == kid)
-        return db.execute(stmt).scalars().first()
+        return (await db.execute(stmt)).scalars().first()
 
     @classmethod
-    def get_valid(cls, db: Session) -> list['KeyPair']:
+    async def get_valid(cls, db: AsyncSession) -> list['KeyPair']:
 
-        # find key pair by kid
+        # find key pairs that did not expire (incl. standby)
         stmt = select(cls).where(cls.exp > datetime.utcnow())
-        return db.execute(stmt).scalars().all()
+        return (await db.execute(stmt)).scalars().all()
+
+    @classmethod
+    async def get_standby(
+        cls,
+        alg: str,
+        db: AsyncSession
+    ) -> list['KeyPair']:
+
+        # find valid standby key pairs for algorithm, oldest first
+        stmt = (
+            select(cls)
+            .where(
+                cls.standby == true(),
+                cls.alg == alg,
+                cls.exp > datetime.utcnow()
+            )
+            .order_by(cls.added_at)
+        )
+        return (await db.execute(stmt)).scalars().all()
+
+    @classmethod
+    async def get_signing(
+        cls,
+        grace: timedelta,
+        alg: str,
+        db: AsyncSession
+    ) -> list['KeyPair']:
+
+        # find key pairs that may sign (algorithm, no standby, not retired)
+        stmt = select(cls).where(
+            cls.standby == false(),
+            cls.alg == alg,
+            cls.exp > datetime.utcnow() + grace
+        )
+        return (await db.execute(stmt)).scalars().all()
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class RevokedToken(DBMixin, Base):
+    __tablename__ = "revoked_token"
+
+    # jwt id (jti) of the revoked token
+    jti = Column(GUID, primary_key=True, nullable=False)
+    # expiration of the token, the row is useless afterwards
+    exp = Column(DateTime, index=True, nullable=False)
+    # workers load tokens revoked since their last refresh
+    revoked_at = Column(DateTime, index=True, nullable=False)
+
+    @classmethod
+    async def is_revoked(cls, jti: uuid.UUID, db: AsyncSession) -> bool:
+
+        # find revoked token by jti (primary key)
+        stmt = select(cls.jti).where(cls.jti == jti)
+        return (await db.execute(stmt)).first() is not None
+
+    @classmethod
+    async def get_jtis_since(
+        cls,
+        since: datetime,
+        db: AsyncSession
+    ) -> list[uuid.UUID]:
+
+        # find jtis of tokens revoked since given time, not expired
+        stmt = select(cls.jti).where(
+            cls.revoked_at >= since,
+            cls.exp > datetime.utcnow()
+        )
+        return (await db.execute(stmt)).scalars().all()
+
+    @classmethod
+    async def stream_jtis(
+        cls,
+        batch_size: int,
+        db: AsyncSession
+    ) -> AsyncIterator[list[uuid.UUID]]:
+
+        # jtis of all revoked tokens that did not expire, in batches
+        stmt = (
+            select(cls.jti)
+            .where(cls.exp > datetime.utcnow())
+            .execution_options(yield_per=batch_size)
+        )
+        result = await db.stream_scalars(stmt)
+        async for partition in result.partitions():
+            yield partition
+
+    @classmethod
+    async def delete_expired(cls, db: AsyncSession) -> int:
+
+        # delete revoked tokens that expired anyway
+        stmt = delete(cls).where(cls.exp <= datetime.utcnow())
+        result = await db.execute(stmt)
+        await db.commit()
+        return result.rowcount
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class Scope(DBMixin, Base):
+    __tablename__ = "scope"
+    # GET /scope?prefix= and a:* lookups on PostgreSQL
+    __table_args__ = (prefix_index('ix_scope_name_prefix', 'name'),)
+
+    id = Column(GUID, primary_key=True, nullable=False)
+    # scope granted by at least one role (billing:invoices:read, billing:*)
+    name = Column(String, unique=True, index=True, nullable=False)
+
+    @classmethod
+    def matching(cls, name: str) -> ColumnElement:
+        """
+        scopes granting name (name, wildcards above it, *)
+        name ending with :* also matches every scope below it
+        """
+        clause = cls.name.in_(granting_scopes(name))
+        if name.endswith(SEPARATOR + WILDCARD):
+            below = and_(*prefix_filter(cls.name, name[:-len(WILDCARD)]))
+            clause = or_(clause, below)
+        return clause
+
+    @classmethod
+    async def get_names(
+        cls,
+        prefix: str | None,
+        db: AsyncSession
+    ) -> list[str]:
+
+        # find scope names (starting with prefix) ordered by name
+        stmt = select(cls.name).order_by(cls.name)
+        if prefix:
+            stmt = stmt.where(*prefix_filter(cls.name, prefix))
+        return (await db.execute(stmt)).scalars().all()
 
     def __str__(self):
         return str(self.__dict__)
+
+
+class RoleScope(DBMixin, Base):
+    __tablename__ = "role_scope"
+
+    # mirrors role.scopes (normalized), kept in sync by crud/scope.py
+    role_id = Column(
+        GUID, ForeignKey("role.id"),
+        nullable=False,
+        primary_key=True
+    )
+    scope_id = Column(
+        GUID, ForeignKey("scope.id"),
+        nullable=False,
+        primary_key=True,
+        # roles by scope (primary key starts with role_id)
+        index=True
+    )
@@ -1,46 +1,109 @@
-import json
+from typing import AsyncIterator, Literal
 
 from fastapi.datastructures import UploadFile
-from fastapi.encoders import jsonable_encoder
 from fastapi.param_functions import Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.routing import APIRouter
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import crud, logger, models, schemas
+from .. import config, crud, schemas
 from ..dependencies import database, security
-from ..utils import auth
+from ..exceptions import ImportFailedException
+from ..utils import auth, jsonstream
 from ..utils.constants import Scopes
 
 router = APIRouter()
 
+# media types of the export formats
+EXPORT_MEDIA_TYPES = {
+    'json': 'application/json',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+async def export_batches(
+    export_users: bool,
+    export_roles: bool
+) -> AsyncIterator[tuple[str, list[schemas.BaseModel]]]:
+    """
+    yields (entity, batch) of roles and then users
+    uses its own session, the response is streamed after the endpoint returns
+    """
+
+    async with database.SessionLocal() as db:
+        if export_roles:
+            async for batch in crud.stream_roles(config.EXPORT_BATCH_SIZE, db):
+                yield 'roles', batch
+        if export_users:
+            async for batch in crud.stream_users(config.EXPORT_BATCH_SIZE, db):
+                yield 'users', batch
+
+
+async def export_json(
+    export_users: bool,
+    export_roles: bool
+) -> AsyncIterator[bytes]:
+    """
+    streams {"roles": [...], "users": [...]} one batch at a time
+    (same document as before, can be imported as is)
+    """
+
+    current = None
+    async for entity, batch in export_batches(export_users, export_roles):
+        if entity != current:
+            # open list of next entity (close previous one)
+            prefix = '{' if current is None else '],'
+            yield f'{prefix}"{entity}":['.encode()
+            current = entity
+        else:
+            yield b','
+        yield ','.join(item.json() for item in batch).encode()
+
+    yield b'{}' if current is None else b']}'
+
+
+async def export_jsonl(
+    export_users: bool,
+    export_roles: bool
+) -> AsyncIterator[bytes]:
+    """
+    streams JSON Lines, one entity per line: {"role": {...}} / {"user": {...}}
+    roles come first, so imports can assign them to users right away
+    """
+
+    async for entity, batch in export_batches(export_users, export_roles):
+        # "roles" -> "role", "users" -> "user"
+        key = entity[:-1]
+        yield ''.join(
+            f'{{"{key}":{item.json()}}}\n' for item in batch).encode()
+
 
 @router.get('/export', tags=['export'])
 async def export_authopie(
     export_users: bool = True,
     export_roles: bool = True,
+    format: Literal['json', 'jsonl'] = 'json',
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     """
     endpoint for exporting settings, users and roles
+    - streamed from db in batches, memory stays flat
+    - format json: one document, jsonl: one user/role per line
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.GOD, db)
 
-    export = dict()
-
-    if export_users:
-        # export users from db into expo
-        export['users'] = jsonable_encoder(crud.get_all_users(db))
+    stream = export_jsonl if format == 'jsonl' else export_json
+    filename = f'authopie-export.{format}'
 
-    if export_roles:
-        # export roles from db into expo
-        export['roles'] = jsonable_encoder(crud.get_all_roles(db))
-
-    return JSONResponse(export)
+    return StreamingResponse(
+        stream(export_users, export_roles),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
 
 
 @router.post('/import', tags=['import'])
@@ -48,57 +111,41 @@ async def import_authopie(
     file: UploadFile,
     import_users: bool = True,
     import_roles: bool = True,
+    format: Literal['json', 'jsonl'] = 'json',
+    mode: Literal['replace', 'merge'] = 'replace',
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     """
     endpoint for importing settings, users and roles
+    - accepts both export formats (json, jsonl)
+    - file is parsed entry by entry and inserted in batches
+    - replace: deletes all users/roles, inserts the imported ones
+    - merge: matches users/roles by name, writes only differences
+      (inserts new, updates changed, deletes missing ones)
+    - one transaction, on failure nothing changes
+    Success: returns number of imported (replace) or
+      inserted/updated/deleted/unchanged (merge) rows
+    Failure: 400 Bad Request
     """
 
-    contents = await file.read()
-
-    impo = json.loads(contents)
-
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.GOD, db)
 
-    if import_roles or import_users:
-        from ..dependencies.database import Base, engine
-
-        Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
-
-    if import_roles:
-        # import roles from impo into db
-        for role in impo['roles']:
-            # import role from dict
-            r = schemas.RoleInDB.parse_obj(role)
+    read = jsonstream.iter_jsonl if format == 'jsonl' else jsonstream.iter_json
 
-            # create role in db
-            models.Role.create(r, db)
+    run_import = crud.merge_all if mode == 'merge' else crud.import_all
 
-        logger.debug('Roles successfully imported')
-
-    if import_users:
-        # import users from impo into db
-        for user in impo['users']:
-
-            # import user from dict
-            u = schemas.UserInDB.parse_obj(user)
-
-            # if roles shouldnt be imported, delete them from schema
-            if not import_roles:
-                u.roles = None
-
-            # create user in db
-            models.User.create(u, db)
-
-        logger.debug('Users successfully imported')
-
-    resp = dict(
-        users=str(import_users),
-        roles=str(import_roles),
-    )
+    try:
+        counts = await run_import(
+            read(file),
+            import_users,
+            import_roles,
+            config.IMPORT_BATCH_SIZE,
+            db
+        )
+    except jsonstream.JSONStreamError as exc:
+        raise ImportFailedException(str(exc))
 
-    return JSONResponse(resp)
+    return JSONResponse(counts)
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from jose import jwk
+from fastapi import APIRouter, Depends, Header, status
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import schemas, crud
+from .. import config, crud, schemas
 from ..dependencies import database
 
 router = APIRouter(
@@ -10,23 +10,40 @@ router = APIRouter(
 )
 
 
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    """
+    checks if the etag is listed in the If-None-Match header
+    (weak comparison, as required for If-None-Match)
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag in tags
+
+
 @router.get('/.well-known/jwks.json', response_model=schemas.JWKS)
-async def get_jwks(db: Session = Depends(database.get)) -> schemas.JWKS:
+async def get_jwks(
+    if_none_match: str | None = Header(None),
+    db: AsyncSession = Depends(database.get)
+) -> Response:
     """
     public endpoint for retrieving the json web key set of this auth server
+    - serialized set is cached and only rebuilt when key pairs change
+    - clients may cache it (Cache-Control) and revalidate it (ETag)
     """
 
-    jwks = []
-
-    # get key pairs from database
-    key_pair_list: list[schemas.KeyPair] = crud.get_valid_key_pairs(db)
+    body, etag = await crud.get_jwks(db)
 
-    # iterate over key pairs and construct jwk for every pair
-    for key_pair in key_pair_list:
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={config.JWKS_MAX_AGE}',
+    }
 
-        key_dict = jwk.construct(key_pair.public_key, 'RS256').to_dict()
-        # set key id (kid) and create schema
-        key = schemas.JWK(**key_dict, kid=key_pair.kid)
-        jwks.append(key)
+    # client already has the current key set
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=headers)
 
-    return schemas.JWKS(keys=jwks)
+    return Response(body, media_type='application/json', headers=headers)
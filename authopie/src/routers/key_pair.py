@@ -1,11 +1,12 @@
 """ GET key pair, POST key pair, DELETE key pair """
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import crud, schemas
 from ..dependencies import database, security
 from ..utils import auth
 from ..utils.constants import Scopes
+from ..utils.rotation import rotation
 
 router = APIRouter(
     prefix='/key_pair',
@@ -16,7 +17,7 @@ router = APIRouter(
 @router.get('{kid}', response_model=schemas.KeyPairOut)
 async def get_key_pair(
     kid: str,
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> schemas.KeyPairOut:
     """
@@ -25,16 +26,16 @@ async def get_key_pair(
     failure: raise 404 Not Found
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_KEY_PAIRS, db)
 
-    return crud.get_key_pair(kid, db)
+    return await crud.get_key_pair(kid, db)
 
 
 @router.get('', response_model=list[schemas.KeyPairOut])
 async def get_all_key_pairs(
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> list[schemas.KeyPairOut]:
     """
@@ -42,16 +43,16 @@ async def get_all_key_pairs(
     failure: raise 404 Not Found
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_KEY_PAIRS, db)
 
-    return crud.get_all_key_pairs(db)
+    return await crud.get_all_key_pairs(db)
 
 
 @router.post('', response_model=schemas.KeyPairOut)
 async def create_key_pair(
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> schemas.KeyPairOut:
     """
@@ -59,17 +60,17 @@ async def create_key_pair(
     success: returns keypair that was created
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_KEY_PAIRS, db)
 
-    return crud.create_key_pair(db)
+    return await crud.create_key_pair(db)
 
 
 @router.delete('/{kid}', response_model=schemas.KeyPairOut)
 async def delete_key_pair(
     kid: str,
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> schemas.KeyPairOut:
     """
@@ -78,8 +79,13 @@ async def delete_key_pair(
     failure: raise 404 Not Found
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_KEY_PAIRS, db)
 
-    return crud.delete_key_pair(kid, db)
+    key_pair = await crud.delete_key_pair(kid, db)
+
+    # standby key pair may have been promoted -> create a new one
+    rotation.wake()
+
+    return key_pair
@@ -0,0 +1,25 @@
+""" GET METRICS (prometheus text format) """
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..utils import metrics
+
+router = APIRouter(
+    tags=['metrics'],
+)
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """
+    endpoint for prometheus scrapers
+    - stage latencies, db query latencies, cache hits/misses,
+      401/403 counters, db pool and bcrypt queue gauges
+    metrics are kept per worker process (WORKERS > 1: one of them answers)
+    """
+
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type='text/plain; version=0.0.4'
+    )
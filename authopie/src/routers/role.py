@@ -1,11 +1,11 @@
 """ GET role, POST role, DELETE role """
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import crud, schemas
+from .. import config, crud, schemas
 from ..dependencies import database, security
 from ..utils import auth
-from ..utils.constants import Scopes
+from ..utils.constants import ScopeName, Scopes
 
 router = APIRouter(
     prefix='/role',
@@ -16,7 +16,7 @@ router = APIRouter(
 @router.get('/{name}', response_model=schemas.RoleOut)
 async def get_role(
     name: str,
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> schemas.RoleOut:
     """
@@ -25,34 +25,50 @@ async def get_role(
     failure: raise 404 Not Found
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_ROLES, db)
 
-    return crud.get_role(name, db)
+    return await crud.get_role(name, db)
 
 
 @router.get('', response_model=list[schemas.RoleOut])
 async def get_all_roles(
-    db: Session = Depends(database.get),
+    response: Response,
+    limit: int = Query(config.PAGE_SIZE, ge=1, le=config.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    prefix: str | None = None,
+    scope: ScopeName | None = None,
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> list[schemas.RoleOut]:
     """
-    success: returns all roles in db
-    failure: raise 404 Not Found
+    lists roles ordered by name, page by page
+    - limit: roles per page
+    - cursor: X-Next-Cursor header of the previous page
+    - prefix: only roles whose name starts with prefix
+    - scope: only roles granting this scope (a:* -> all scopes below a)
+    success: returns roles of the page, X-Next-Cursor header is set
+      if there are more roles
+    failure (malformed cursor): 400 Bad Request
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_ROLES, db)
 
-    return crud.get_all_roles(db)
+    roles, next_cursor = await crud.get_roles_page(
+        limit, cursor, prefix, scope, db)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    return roles
 
 
 @router.post('', response_model=schemas.RoleOut)
 async def create_role(
     role: schemas.RoleIn,
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> schemas.RoleOut:
     """
@@ -61,11 +77,11 @@ async def create_role(
     role already exists: raise 409 Conflict
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_ROLES, db)
 
-    return crud.create_role(role, db)
+    return await crud.create_role(role, db)
 
 
 @router.put('/{name}', response_model=schemas.RoleOut)
@@ -73,7 +89,7 @@ async def update_role(
     name: str,
     role: schemas.RoleInUpdate,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ) -> schemas.RoleOut:
     """
     Update data of existing role
@@ -82,17 +98,17 @@ async def update_role(
     Auth Failure: 401 Unauthorized
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_ROLES, db)
 
-    return crud.update_role(name, role, db)
+    return await crud.update_role(name, role, db)
 
 
 @router.delete('/{name}', response_model=schemas.RoleOut)
 async def delete_role(
     name: str,
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
     token_str: str = Depends(security.OAuth2AccessCookieBearer())
 ) -> schemas.RoleOut:
     """
@@ -101,8 +117,8 @@ async def delete_role(
     failure: raise 404 Not Found
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_ROLES, db)
 
-    return crud.delete_role(name, db)
+    return await crud.delete_role(name, db)
@@ -0,0 +1,32 @@
+""" GET scope """
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import crud
+from ..dependencies import database, security
+from ..utils import auth
+from ..utils.constants import Scopes
+
+router = APIRouter(
+    prefix='/scope',
+    tags=['scope'],
+)
+
+
+@router.get('', response_model=list[str])
+async def get_all_scopes(
+    prefix: str | None = None,
+    db: AsyncSession = Depends(database.get),
+    token_str: str = Depends(security.OAuth2AccessCookieBearer())
+) -> list[str]:
+    """
+    lists all scopes granted by at least one role, ordered by name
+    - prefix: only scopes starting with prefix
+    success: returns scope names
+    """
+
+    token = await auth.authenticate_user(token_str, db)
+
+    auth.authorize_user(token, Scopes.MANAGE_ROLES, db)
+
+    return await crud.get_scopes(prefix, db)
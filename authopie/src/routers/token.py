@@ -1,14 +1,15 @@
 """ GET TOKEN, UPDATE TOKEN, GET API TOKEN """
 
-from fastapi import APIRouter, Body, Depends
+from fastapi import APIRouter, Body, Depends, status
 from fastapi.responses import Response
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..utils import auth, cookie
+from ..utils import auth, cookie, metrics
+from ..utils.revocation import revocation
 
 from .. import crud, logger, schemas
 from ..dependencies import database, security
-from ..utils.constants import Scopes
+from ..utils.constants import Scopes, Username
 from ..exceptions import IncorrectCredentialsException
 
 router = APIRouter(
@@ -18,10 +19,11 @@ router = APIRouter(
 
 
 @router.post('', response_model=schemas.UserOut)
+@metrics.timed('login_for_token')
 async def login_for_token(
     response: Response,
     form_data: security.LoginRequestForm = Depends(),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     """
     Endpoint to retrieve the first token (access + refresh token pair)
@@ -32,14 +34,13 @@ async def login_for_token(
     Failure: Returns 401 Unauthorized
     """
 
-    print(form_data.username, form_data.password)
-
-    # check username and password
-    user = crud.authenticate_user(
-        form_data.username,
-        form_data.password,
-        db
-    )
+    # check username and password (db + bcrypt)
+    with metrics.stage('login_for_token.check_credentials'):
+        user = await crud.authenticate_user(
+            form_data.username,
+            form_data.password,
+            db
+        )
 
     # wrong credentials
     if not user:
@@ -47,7 +48,8 @@ async def login_for_token(
         raise IncorrectCredentialsException
 
     # create new token pair (access_token/refresh_token)
-    token_pair = auth.create_token_pair(user, db)
+    with metrics.stage('login_for_token.create_token_pair'):
+        token_pair = await auth.create_token_pair(user, db)
 
     # add cookie for access_token
     cookie.set_cookie(response, 'access_token', token_pair.access_token)
@@ -62,7 +64,7 @@ async def login_for_token(
 async def refresh_token(
     response: Response,
     token_str: str = Depends(security.OAuth2RefreshCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     """
     Generate a new token pair by giving a correct refresh_token
@@ -73,10 +75,13 @@ async def refresh_token(
     """
 
     # authenticate token / user with given refresh token
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
+
+    # new token pair needs current user data (roles -> scopes)
+    user = await auth.get_token_user(token, db)
 
     # create new token pair (access_token/refresh_token)
-    token_pair = auth.create_token_pair(token.user, db)
+    token_pair = await auth.create_token_pair(user, db)
 
     # add cookie for access_token
     cookie.set_cookie(response, 'access_token', token_pair.access_token)
@@ -84,13 +89,13 @@ async def refresh_token(
     # add cookie for refresh_token
     cookie.set_cookie(response, 'refresh_token', token_pair.refresh_token)
 
-    return token.user
+    return user
 
 
 @router.post('/test', response_model=schemas.TokenOut)
 async def test_token(
     token_to_test: str = Body(),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ):
     """
     Test Endpoint: Checks given tokens for validity
@@ -98,16 +103,43 @@ async def test_token(
     AuthN Failure: Returns 401 Unauthorized
     """
 
-    token = auth.validate_jwt(token_to_test, db)
+    token = await auth.validate_jwt(token_to_test, db)
 
     return token
 
 
+@router.post('/revoke', status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_token(
+    token_to_revoke: str = Body(),
+    token_str: str = Depends(security.OAuth2AccessCookieBearer()),
+    db: AsyncSession = Depends(database.get)
+):
+    """
+    Revokes given token (by jti), it gets rejected from now on
+    - users may revoke their own tokens
+    - revoking tokens of other users needs manage-users
+    Success: returns 204 No Content
+    AuthN Failure (caller or given token invalid): Returns 401 Unauthorized
+    AuthZ Failure: Returns 403 Forbidden
+    """
+
+    token = await auth.authenticate_user(token_str, db)
+
+    revoked_token = await auth.validate_jwt(token_to_revoke, db)
+
+    if revoked_token.sub != token.sub:
+        auth.authorize_user(token, Scopes.MANAGE_USERS, db)
+
+    await revocation.revoke(revoked_token, db)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @router.post('/api')
 async def get_api_token(
     new_token_data: schemas.TokenIn,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ) -> str:
     """
     Generates a new API-Token (JWT)
@@ -118,7 +150,7 @@ async def get_api_token(
 
     # TODO discuss security aspects and possible misuses of this
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.GOD, db)
 
@@ -129,7 +161,7 @@ async def get_api_token(
         scopes=new_token_data.scopes
     )
 
-    key_pair = crud.get_random_valid_key_pair(db)
+    key_pair = await crud.get_signing_key(db)
 
     return auth.encode_token(key_pair, api_token)
 
@@ -146,3 +178,35 @@ async def logout():
     cookie.delete_cookie(response, 'access_token')
     cookie.delete_cookie(response, 'refresh_token')
     return response
+
+
+@router.post('/logout/all')
+async def logout_everywhere(
+    username: Username | None = None,
+    token_str: str = Depends(security.OAuth2AccessCookieBearer()),
+    db: AsyncSession = Depends(database.get)
+):
+    """
+    log out user everywhere: all tokens issued so far are rejected
+    - username: user to log out (default: the caller)
+    - logging out other users needs manage-users
+    Success: returns 200 OK, cookies are deleted if the caller logged out
+    AuthN Failure: Returns 401 Unauthorized
+    AuthZ Failure: Returns 403 Forbidden
+    Failure (user does not exist): Returns 404 Not Found
+    """
+
+    token = await auth.authenticate_user(token_str, db)
+
+    if username is None:
+        username = token.sub
+    elif username != token.sub:
+        auth.authorize_user(token, Scopes.MANAGE_USERS, db)
+
+    await crud.invalidate_tokens(username, db)
+
+    response = Response()
+    if username == token.sub:
+        cookie.delete_cookie(response, 'access_token')
+        cookie.delete_cookie(response, 'refresh_token')
+    return response
@@ -1,12 +1,12 @@
 """ GET user, POST user, PUT user, DELETE user """
 
-from fastapi import APIRouter, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import crud, schemas
+from .. import config, crud, schemas
 from ..dependencies import database, security
 from ..utils import auth
-from ..utils.constants import Scopes, Username
+from ..utils.constants import ScopeName, Scopes, Username
 
 router = APIRouter(
     prefix='/user',
@@ -18,7 +18,7 @@ router = APIRouter(
 async def get_user(
     username: Username,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
 ) -> schemas.UserOut:
     """
     searches db for user with given username
@@ -28,29 +28,48 @@ async def get_user(
     """
 
     # validates JWT + checks if user in token sub exists
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_USERS, db)
 
-    return crud.get_user(username, db)
+    return await crud.get_user(username, db)
 
 
 @router.get('', response_model=list[schemas.UserOut])
 async def get_all_users(
+    response: Response,
+    limit: int = Query(config.PAGE_SIZE, ge=1, le=config.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    prefix: str | None = None,
+    role: str | None = None,
+    scope: ScopeName | None = None,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get),
+    db: AsyncSession = Depends(database.get),
 ) -> list[schemas.UserOut]:
     """
-    success: returns all users in db
+    lists users ordered by username, page by page
+    - limit: users per page
+    - cursor: X-Next-Cursor header of the previous page
+    - prefix: only users whose username starts with prefix
+    - role: only users having the role with this name
+    - scope: only users granted this scope (a:* -> all scopes below a)
+    success: returns users of the page, X-Next-Cursor header is set
+      if there are more users
+    failure (malformed cursor): 400 Bad Request
     Auth Failure: 401 Unauthorized
     """
 
     # validates JWT + checks if user in token sub exists
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_USERS, db)
 
-    return crud.get_all_users(db)
+    users, next_cursor = await crud.get_users_page(
+        limit, cursor, prefix, role, scope, db)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    return users
 
 
 @router.post(
@@ -61,7 +80,7 @@ async def get_all_users(
 async def create_user(
     user: schemas.UserIn,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ) -> schemas.UserOut:
     """
     checks db for user with given username and then creates user in db
@@ -71,11 +90,11 @@ async def create_user(
     AuthZ Failure: 403 Forbidden
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_USERS, db)
 
-    return crud.create_user(user, db)
+    return await crud.create_user(user, db)
 
 
 @router.put('/{username}', response_model=schemas.UserOut)
@@ -83,7 +102,7 @@ async def update_user(
     username: Username,
     user: schemas.UserInUpdate,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ) -> schemas.UserOut:
     """
     Update data of existing user
@@ -92,18 +111,18 @@ async def update_user(
     Auth Failure: 401 Unauthorized
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_USERS, db)
 
-    return crud.update_user(username, user, db)
+    return await crud.update_user(username, user, db)
 
 
 @router.delete('/{username}', response_model=schemas.UserOut)
 async def delete_user(
     username: Username,
     token_str: str = Depends(security.OAuth2AccessCookieBearer()),
-    db: Session = Depends(database.get)
+    db: AsyncSession = Depends(database.get)
 ) -> schemas.UserOut:
     """
     searches db for user with given name and deletes it
@@ -112,8 +131,8 @@ async def delete_user(
     Auth Failure: 401 Unauthorized
     """
 
-    token = auth.authenticate_user(token_str, db)
+    token = await auth.authenticate_user(token_str, db)
 
     auth.authorize_user(token, Scopes.MANAGE_USERS, db)
 
-    return crud.delete_user(username, db)
+    return await crud.delete_user(username, db)
@@ -1,3 +1,4 @@
+import re
 import uuid
 from datetime import datetime
 from time import time
@@ -5,7 +6,8 @@ from time import time
 from pydantic import BaseModel, Extra, Field, root_validator, validator
 
 from . import config
-from .utils.constants import Username, Password
+from .utils.constants import Password, ScopeName, Username
+from .utils.scopes import SCOPE_PATTERN
 
 
 class HashableBaseModel(BaseModel):
@@ -32,7 +34,17 @@ class RoleBase(HashableBaseModel):
 
 
 class RoleIn(RoleBase):
-    pass
+
+    # roles in db are not checked, they may predate the grammar
+    @validator('scopes')
+    def check_scope_grammar(cls, v):
+        for scope in (v or '').split():
+            if re.match(SCOPE_PATTERN, scope) is None:
+                raise ValueError(
+                    f'invalid scope {scope!r}: segments of letters, digits, '
+                    f'_ . - separated by ":" (billing:invoices:read), '
+                    f'optionally ending with ":*" (billing:*) or "*" alone')
+        return v
 
 
 class RoleInUpdate(RoleIn):
@@ -100,6 +112,8 @@ class UserInDB(UserBase):
     id: uuid.UUID = Field(default_factory=uuid.uuid4)
     hashed_password: str
     roles: list[RoleInDB] | None = []
+    # tokens carrying another version are rejected
+    token_version: int = 0
 
     class Config:
         orm_mode = True
@@ -110,10 +124,12 @@ class UserInDB(UserBase):
 
 class KeyPair(HashableBaseModel):
     kid: str                        # Key ID
-    public_key: str                 # PEM encoded public RSA key
-    private_key: str                # PEM encoded private RSA key
+    alg: str = 'RS256'              # signing algorithm (RS256/ES256/EdDSA)
+    public_key: str                 # PEM encoded public key
+    private_key: str                # PEM encoded private key
     exp: datetime                   # exprire date
     added_at: datetime | None    # datetime of model creation
+    standby: bool = False           # published, but not used for signing
 
     @validator('added_at', pre=True, always=True)
     def add_added_at(cls, v):
@@ -126,8 +142,10 @@ class KeyPair(HashableBaseModel):
 
 class KeyPairOut(HashableBaseModel):
     kid: str                        # Key ID
+    alg: str = 'RS256'              # signing algorithm (RS256/ES256/EdDSA)
     exp: datetime                   # exprire date
     added_at: datetime | None    # datetime of model creation
+    standby: bool = False           # published, but not used for signing
 
 
 """ Token """
@@ -148,8 +166,12 @@ class Token(HashableBaseModel):
     iat: int | None = int(time())
     # jwt id
     jti: uuid.UUID | None = Field(default_factory=uuid.uuid4)
-    # areas the user has access to
-    scopes: list[str] = []
+    # areas the user has access to (a set, serialized as sorted list)
+    scopes: frozenset[str] = frozenset()
+    # token version of the user when the token was created
+    ver: int | None = None
+    # id of the user, a re-created username gets a new id
+    uid: uuid.UUID | None = None
     # user the token was created for
     user: UserInDB | None
     # easteregg
@@ -157,6 +179,7 @@ class Token(HashableBaseModel):
 
     class Config:
         extra = Extra.allow  # allows us to append extra data
+        json_encoders = {frozenset: sorted}
 
 
 class TokenOut(Token):
@@ -172,7 +195,7 @@ class TokenIn(HashableBaseModel):
     # audience (Empfänger)
     aud: str
     # areas the user has access to
-    scopes: list[str] = []
+    scopes: list[ScopeName] = []
 
 
 """ Pure Response Models """
@@ -186,11 +209,18 @@ class TokenPair(HashableBaseModel):
 
 class JWK(HashableBaseModel):
     kid: str            # Key ID
-    kty: str = 'RSA'    # Key Type / key family
+    kty: str = 'RSA'    # Key Type / key family (RSA, EC, OKP)
     alg: str = 'RS256'  # Algorithm
     use: str = 'sig'    # sig (sign) or enc (encrypt)
-    n: str              # modulus
-    e: str = 'AQAB'     # public exponent
+
+    # RSA
+    n: str | None       # modulus
+    e: str | None       # public exponent
+
+    # EC (P-256) / OKP (Ed25519)
+    crv: str | None     # curve
+    x: str | None       # x coordinate / public key
+    y: str | None       # y coordinate (EC only)
 
     # TODO: for now optional
     x5c: str | None  # x.509 certificate chain
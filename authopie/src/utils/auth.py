@@ -1,24 +1,26 @@
-from datetime import datetime, timedelta
+import uuid
+from datetime import timedelta
+from time import time
 
-from fastapi.encoders import jsonable_encoder
-from jose import jws, jwt
-from jose.exceptions import JWSError, JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import config, crud, logger, schemas
 from ..exceptions import (ActionForbiddenException,
                           EntityDoesNotExistException,
                           TokenValidationFailedException, TypeException)
+from . import jwt_codec, metrics
+from . import scopes
 from .constants import Scopes
+from .keys import SigningKey
+from .revocation import revocation
 
 
 def calculate_token_exp(expires_in: timedelta):
     """
-    returns token expiry time as integer epoch timestamp
+    returns token expiry time as integer unix timestamp
+    (seconds since 1970, like nbf, iat and the exp check of jwt_codec)
     """
-    now = datetime.utcnow()
-    epoch = datetime(1900, 1, 1)
-    return (now+expires_in-epoch).total_seconds()
+    return int(time() + expires_in.total_seconds())
 
 
 def exp_access_token():
@@ -37,33 +39,34 @@ def exp_refresh_token():
     return calculate_token_exp(lifetime)
 
 
+@metrics.timed('encode_token')
 def encode_token(
-    key_pair: schemas.KeyPair,
+    key_pair: SigningKey,
     token: schemas.Token
 ) -> str:
     """
-    takes a token schema and encodes it with given private key
+    takes a token schema and encodes it with given (parsed) private key
     returns a encoded JWT string
     """
 
-    # create payload (encode to dict)
-    payload = jsonable_encoder(token, exclude=['user'])
-
-    # save kid of signing key in jwt headers
-    headers = dict(kid=key_pair.kid)
+    # create payload (serialize to json)
+    with metrics.stage('encode_token.serialize'):
+        payload = token.json(exclude={'user'}).encode()
 
     # encode token with given private key
-    return jwt.encode(
-        payload,
-        key_pair.private_key,
-        algorithm='RS256',
-        headers=headers
-    )
+    # header (alg, kid of signing key) is prepared by the key ring
+    with metrics.stage('encode_token.sign'):
+        return jwt_codec.encode(
+            key_pair.header,
+            payload,
+            key_pair.private_key,
+            key_pair.alg
+        )
 
 
 def create_access_token(
     user: schemas.UserInDB,
-    key_pair: schemas.KeyPair
+    key_pair: SigningKey
 ) -> schemas.TokenPair:
     """
     Create access token (JWT) for given user
@@ -74,16 +77,17 @@ def create_access_token(
     # calculate lifetime of token (timestamp)
     exp = exp_access_token()
 
-    # get scopes for given user
-    user_scope_set = set()
-    for role in user.roles:
-        # get scope str for each role
-        scopes_set_for_role = set(role.scopes.split(' '))
-        # add new found scopes to user scope
-        user_scope_set.update(scopes_set_for_role)
+    # get scopes for given user (compiled, cached per role set)
+    user_scopes = scopes.effective_scopes(user.roles)
 
     # create token model
-    token = schemas.Token(exp=exp, scopes=user_scope_set, sub=user.username)
+    token = schemas.Token(
+        exp=exp,
+        scopes=user_scopes,
+        sub=user.username,
+        ver=user.token_version,
+        uid=user.id
+    )
 
     # encode token data, get access token
     access_token = encode_token(key_pair, token)
@@ -93,7 +97,7 @@ def create_access_token(
 
 def create_refresh_token(
     user: schemas.UserInDB,
-    key_pair: schemas.KeyPair
+    key_pair: SigningKey
 ) -> schemas.TokenPair:
     """
     Create refresh token (JWT) for given user
@@ -105,7 +109,8 @@ def create_refresh_token(
     exp = exp_refresh_token()
 
     # create token model
-    token = schemas.Token(exp=exp, sub=user.username)
+    token = schemas.Token(
+        exp=exp, sub=user.username, ver=user.token_version, uid=user.id)
 
     # encode token data, get refresh token
     access_token = encode_token(key_pair, token)
@@ -113,17 +118,17 @@ def create_refresh_token(
     return access_token
 
 
-def create_token_pair(
+async def create_token_pair(
     user: schemas.UserInDB,
-    db: Session
+    db: AsyncSession
 ) -> schemas.TokenPair:
     """
-    gets random key pair from db and creates two tokens
-    - access token (JWT), signed with private key from db
-    - refresh token (JWT), signed with private key from db
+    gets random signing key and creates two tokens
+    - access token (JWT), signed with private key
+    - refresh token (JWT), signed with private key
     """
 
-    key_pair = crud.get_random_valid_key_pair(db)
+    key_pair = await crud.get_signing_key(db)
 
     access_token = create_access_token(user, key_pair)
     refresh_token = create_refresh_token(user, key_pair)
@@ -156,7 +161,8 @@ options = {
 }
 
 
-def validate_jwt(token: str, db: Session) -> schemas.Token:
+@metrics.timed('validate_jwt')
+async def validate_jwt(token: str, db: AsyncSession) -> schemas.Token:
     """
     takes JWT string and decodes it using the public RSA key
     success: returns token schema
@@ -164,42 +170,52 @@ def validate_jwt(token: str, db: Session) -> schemas.Token:
     """
 
     if not isinstance(token, str):
-        logger.warn('JWT validation failed - not a string')
-        print(type(token))
+        logger.warning(
+            'JWT validation failed - not a string (%s)', type(token))
         raise TokenValidationFailedException
 
     try:
 
-        # load kid of key that signed given key
-        header = jws.get_unverified_header(token)
-        kid = header['kid']
+        # split token once, load kid of key that signed given key
+        unverified = jwt_codec.parse(token)
+        kid = unverified.header.get('kid')
+        if not isinstance(kid, str):
+            raise jwt_codec.JWTError('No key id (kid) in token header')
 
         try:
-            # load key pair that signed the token from db
-            key_pair = crud.get_key_pair(kid, db)
+            # load public key that signed the token (cached by kid)
+            with metrics.stage('validate_jwt.get_key'):
+                key = await crud.get_verification_key(kid, db)
         except EntityDoesNotExistException as exc:
             # the key pair the token was signed with does not exist (anymore)
             logger.warning(exc.detail)
             raise TokenValidationFailedException
 
-        # get public key for decoding of given JWT
-        public_key = key_pair.public_key
-
-        decoded_token = jwt.decode(
-            token,
-            public_key,
-            algorithms=['RS256'],
-            audience=config.AUD,
-            options=options
-        )
-        token = schemas.Token.parse_obj(decoded_token)
+        # only the algorithm of the key pair is accepted
+        with metrics.stage('validate_jwt.verify'):
+            decoded_token = jwt_codec.decode(
+                unverified,
+                key.public_key,
+                key.alg,
+                audience=config.AUD,
+                options=options
+            )
+        with metrics.stage('validate_jwt.parse_claims'):
+            token = schemas.Token.parse_obj(decoded_token)
+
+        # db is only asked if the jti is in the filter of revoked tokens
+        with metrics.stage('validate_jwt.check_revoked'):
+            if await revocation.is_revoked(token, db):
+                logger.warning(f'Token {token.jti} was revoked')
+                raise TokenValidationFailedException
         return token
-    except (JWTError, JWSError) as exc:
+    except jwt_codec.JWTError as exc:
         logger.warn(exc)
         raise TokenValidationFailedException
 
 
-def authenticate_user(token_str: str, db: Session) -> schemas.Token:
+@metrics.timed('authenticate_user')
+async def authenticate_user(token_str: str, db: AsyncSession) -> schemas.Token:
     """
     Make sure the user is who he claims to be
     by checking the given JWT
@@ -210,14 +226,73 @@ def authenticate_user(token_str: str, db: Session) -> schemas.Token:
     """
 
     # check if given refresh_token (JWT) is valid, raises 401 Unauthorized
-    token = validate_jwt(token_str, db)
+    token = await validate_jwt(token_str, db)
+
+    if config.STATELESS_AUTH:
+        # trust signature, exp and scopes of the JWT
+        # user gets loaded only if needed (get_token_user)
+        if token.ver is not None:
+            with metrics.stage('authenticate_user.check_version'):
+                try:
+                    user_id, version = await crud.get_token_version(
+                        token.sub, db)
+                except EntityDoesNotExistException:
+                    logger.warning('JWT contains an unknown username')
+                    raise TokenValidationFailedException
+            check_token_version(token, user_id, version)
+        return token
+
+    with metrics.stage('authenticate_user.load_user'):
+        user = await get_token_user(token, db)
+    check_token_version(token, user.id, user.token_version)
+    return token
+
+
+def check_token_version(
+    token: schemas.Token,
+    user_id: uuid.UUID,
+    version: int
+) -> None:
+    """
+    compares token version (ver) and user id (uid) with the current user
+    tokens without version (api tokens) are not checked
+    success: returns None
+    failure (user logged out everywhere, password/roles changed since,
+      user deleted and username created again): raises 401 Unauthorized
+    """
+
+    if token.ver is None:
+        return
+
+    if token.uid != user_id:
+        logger.warning(f'Token {token.jti} belongs to another user')
+        raise TokenValidationFailedException
+
+    if token.ver != version:
+        logger.warning(f'Token {token.jti} has an outdated version')
+        raise TokenValidationFailedException
+
+
+async def get_token_user(
+    token: schemas.Token,
+    db: AsyncSession
+) -> schemas.UserInDB:
+    """
+    returns the user of the given (validated) token
+    - loads user in token.sub if not done yet
+    success: returns user, assigned to token
+    failure (user does not exist): raises 401 Unauthorized
+    """
+
+    if token.user is not None:
+        return token.user
 
     try:
-        # get username from token (stored in sub) and search for it in db
-        user = crud.get_user(token.sub, db)
+        # get username from token (stored in sub) and search for it
+        user = await crud.get_principal(token.sub, db)
         # assign user to token
         token.user = user
-        return token
+        return user
     except EntityDoesNotExistException:
         logger.warn('JWT contains a username that doesnt exist!')
         raise TokenValidationFailedException
@@ -226,7 +301,7 @@ def authenticate_user(token_str: str, db: Session) -> schemas.Token:
 def authorize_user(
     token: schemas.Token,
     required_scope: Scopes,
-    db: Session
+    db: AsyncSession
 ) -> None:
     """
     Make sure the user has permissions to
@@ -0,0 +1,77 @@
+""" small in-process caches (bounded size, per entry expiry) """
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable
+
+from .metrics import cache_requests
+
+
+class TTLCache:
+    """
+    Bounded LRU cache where every entry carries its own expiry time
+    - get: returns cached value or None (expired entries are dropped)
+    - set: stores value for ttl seconds (falls back to default ttl)
+    - least recently used entries get evicted once maxsize is reached
+    thread safe, so it can be shared between requests
+    lookups are counted as hits/misses under name (GET /metrics)
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = 'default'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        """ returns value for key or None if missing/expired """
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                cache_requests.inc(self.name, 'miss')
+                return None
+            expires_at, value = entry
+            if expires_at <= monotonic():
+                # entry outlived its ttl -> drop it
+                del self._data[key]
+                cache_requests.inc(self.name, 'miss')
+                return None
+            # mark entry as recently used
+            self._data.move_to_end(key)
+            cache_requests.inc(self.name, 'hit')
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """ stores value for key, evicts least recently used entries """
+
+        if self.maxsize <= 0:
+            # cache is disabled
+            return
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """ removes key from cache (if present) """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """ removes all entries """
+
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
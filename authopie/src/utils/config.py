@@ -3,6 +3,7 @@
 import json
 from os import path
 from pathlib import Path
+from typing import Literal
 
 from pydantic import BaseSettings, Field
 
@@ -14,6 +15,19 @@ class Settings(BaseSettings):
     PORT = 5555
     LOG_LEVEL = 'debug'
 
+    # format of the authopie log (text: colored lines, json: one object
+    # per line for log collectors)
+    LOG_FORMAT: Literal['text', 'json'] = 'text'
+
+    # number of worker processes (ignored if RELOAD is true)
+    WORKERS: int = 1
+
+    # restart server on code changes (development only)
+    RELOAD: bool = False
+
+    # seconds to wait for open requests before workers get killed
+    GRACEFUL_SHUTDOWN_TIMEOUT: int = 10
+
     # first user to be created (admin)
     DEFAULT_USER_USERNAME: str = Field(env='ADMIN_USERNAME')
     DEFAULT_USER_PASSWORD: str = Field(env='ADMIN_PASSWORD')
@@ -24,6 +38,31 @@ class Settings(BaseSettings):
     # path where database gets saved
     DB_PATH: Path = './auth.db'
 
+    # database to connect to, e.g. postgresql://user:pw@host/authopie
+    # if not set the SQLite database at DB_PATH is used
+    DATABASE_URL: str | None = None
+
+    # database connection pool (connections kept open / extra under load)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # seconds to wait for a free connection before failing
+    DB_POOL_TIMEOUT: int = 30
+    # seconds after which connections get replaced (-1 never)
+    DB_POOL_RECYCLE: int = 1800
+
+    # SQLite tuning, applied to every new connection
+    # WAL lets readers continue while a writer is active
+    SQLITE_JOURNAL_MODE: Literal[
+        'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'] = 'WAL'
+    # NORMAL is safe with WAL and avoids a fsync per commit
+    SQLITE_SYNCHRONOUS: Literal['OFF', 'NORMAL', 'FULL', 'EXTRA'] = 'NORMAL'
+    # bytes of the db file read via memory mapping (0 disables)
+    SQLITE_MMAP_SIZE: int = 268435456
+    # page cache per connection (negative: KiB, positive: pages)
+    SQLITE_CACHE_SIZE: int = -65536
+    # milliseconds to wait for a lock before raising "database is locked"
+    SQLITE_BUSY_TIMEOUT: int = 5000
+
     # JWT lifetime in minutes
     TOKEN_LIFETIME: int = 5
 
@@ -33,6 +72,62 @@ class Settings(BaseSettings):
     # key pair lifetime in years
     KEY_PAIR_LIFETIME: int = 10
 
+    # algorithm new key pairs sign tokens with
+    # elliptic curve keys (ES256, EdDSA) sign much faster than RSA (RS256)
+    SIGNING_ALGORITHM: Literal['RS256', 'ES256', 'EdDSA'] = 'RS256'
+
+    # seconds between checks of the key rotation service (0 disables it)
+    KEY_ROTATION_INTERVAL: int = 3600
+
+    # days before signing key pairs retire, the standby key pair takes over
+    KEY_ROTATION_LEAD: int = 7
+
+    # max number of parsed public keys kept in memory (0 disables cache)
+    KEY_CACHE_SIZE: int = 64
+
+    # max seconds a cached public key is trusted before reloading from db
+    # (keys expire earlier if the key pair itself expires)
+    # with WORKERS > 1 a deleted key pair is dropped only by the worker
+    # handling the delete, others still accept its tokens this long
+    KEY_CACHE_TTL: int = 300
+
+    # seconds after which parsed signing keys are reloaded from db
+    # (other workers may sign with a deleted key pair this long)
+    SIGNING_KEY_REFRESH: int = 300
+
+    # seconds the serialized JWKS is reused before rebuilding from db
+    # (other workers may publish a deleted key pair this long)
+    JWKS_CACHE_TTL: int = 60
+
+    # seconds clients may cache the JWKS (Cache-Control max-age)
+    JWKS_MAX_AGE: int = 300
+
+    # seconds until tokens revoked on another worker are rejected here too
+    # (0 disables loading them, only the startup state is known)
+    REVOCATION_REFRESH_INTERVAL: int = 5
+
+    # seconds between deleting expired revoked tokens (rebuilds filter)
+    REVOCATION_PRUNE_INTERVAL: int = 3600
+
+    # revoked tokens the in-memory filter is sized for (grows if exceeded)
+    REVOCATION_FILTER_CAPACITY: int = 100000
+
+    # share of valid tokens the filter sends to the db for an exact check
+    REVOCATION_FILTER_ERROR_RATE: float = 0.001
+
+    # max number of tokens revoked on this worker that are rejected
+    # without db lookup, and max seconds they are kept (0 disables cache)
+    REVOKED_TOKEN_CACHE_SIZE: int = 1024
+    REVOKED_TOKEN_CACHE_TTL: int = 3600
+
+    # max number of users (incl. roles) kept in memory for token auth
+    PRINCIPAL_CACHE_SIZE: int = 1024
+
+    # seconds a cached user / token version is trusted for token auth
+    # (0 disables cache), invalidated tokens may work this long on
+    # other workers
+    PRINCIPAL_CACHE_TTL: int = 5
+
     # audience setting of JWT
     AUD: str = 'Authopie'
 
@@ -51,6 +146,18 @@ class Settings(BaseSettings):
     COOKIE_DOMAIN: str = f'{HOST}:{PORT}'
     COOKIE_PATH: str = '/'
 
+    # if true endpoints trust the scopes in a valid JWT and
+    # only load the user from db when they actually need it
+    # (the token version of the user is still checked, cached)
+    STATELESS_AUTH: bool = False
+
+    # number of worker threads hashing/verifying passwords (bcrypt)
+    PWDHASH_WORKERS: int = 4
+
+    # serve GET /metrics (prometheus), metrics are collected either way
+    # not secured -> restrict access to it at the proxy
+    METRICS_ENABLED: bool = True
+
     # turn password regex on
     # -> min 8 digits
     # -> at least one upper case
@@ -59,6 +166,16 @@ class Settings(BaseSettings):
     # -> at least one number
     PASSWORD_REGEX: bool = False
 
+    # users/roles per page of GET /user and GET /role (default, maximum)
+    PAGE_SIZE: int = 100
+    MAX_PAGE_SIZE: int = 1000
+
+    # rows loaded from db at a time while exporting
+    EXPORT_BATCH_SIZE: int = 1000
+
+    # rows inserted into db at a time while importing
+    IMPORT_BATCH_SIZE: int = 1000
+
     # if true username has to be an email -> will be enforced
     USERNAME_IS_EMAIL: bool = True
 
@@ -3,41 +3,42 @@ Scopes for authorizing tokens/users
 (permission management)
 """
 
+import sys
+from typing import Iterable
+
 from pydantic import EmailStr
 import pydantic
 from .. import config
+from .scopes import SCOPE_PATTERN, compile_matcher
 
 
 class Scope:
     """
     Class for comparing required Scopes against scopes in a token
-    Is required to allow setting aliases as shown below:
-    the scope 'manage-users' should be included in '*'
+    Scopes are hierarchical (billing:invoices:read), granted scopes
+    may end with a wildcard (billing:*) or be '*' (every scope)
     """
 
     def __init__(self, *args):
-        self.scopes = list(args)
+        self.scopes = frozenset(sys.intern(scope) for scope in args)
 
-    def __contains__(self, user_scopes: list[str]) -> bool:
+    def __contains__(self, user_scopes: Iterable[str]) -> bool:
         """
         compares given user scopes from JWT (user has those)
         with scopes of this instance (user needs one of those)
+        the matcher of user_scopes is built once per distinct scope set
         """
 
+        if not isinstance(user_scopes, frozenset):
+            user_scopes = frozenset(user_scopes)
+
         # user has user_scopes
         # user needs one of self.scopes
-
-        # compare
-        for user_scope in user_scopes:
-            if user_scope in self.scopes:
-                # found a scope the user has in common with this instance
-                return True
-
-        # no scope of the user satisfied those in this instance
-        return False
+        matcher = compile_matcher(user_scopes)
+        return any(matcher.grants(scope) for scope in self.scopes)
 
     def __str__(self) -> str:
-        return str(self.scopes)
+        return str(sorted(self.scopes))
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -48,9 +49,9 @@ class Scopes:
     All scopes that are internally used
     """
     GOD = Scope('*')
-    MANAGE_USERS = Scope('manage-users', '*')
-    MANAGE_ROLES = Scope('manage-roles', '*')
-    MANAGE_KEY_PAIRS = Scope('manage-key-pairs', '*')
+    MANAGE_USERS = Scope('manage-users')
+    MANAGE_ROLES = Scope('manage-roles')
+    MANAGE_KEY_PAIRS = Scope('manage-key-pairs')
     NONE = Scope('')
 
 
@@ -61,6 +62,9 @@ if config.USERNAME_IS_EMAIL:
 else:
     Username = str
 
+# Type for a single scope (hierarchical, see Scope)
+ScopeName = pydantic.constr(regex=SCOPE_PATTERN)
+
 # Type for password is defined by config
 # -> either a str or a string with regex
 if config.PASSWORD_REGEX:
@@ -0,0 +1,163 @@
+"""
+read large JSON / JSON Lines uploads entry by entry
+only the current chunk and entry are held in memory
+"""
+
+import codecs
+import json
+from typing import Any, AsyncIterator, Protocol
+
+# bytes read from the upload at a time
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+decoder = json.JSONDecoder()
+
+
+class JSONStreamError(ValueError):
+    """ upload is no valid JSON (Lines) document """
+
+
+class AsyncReadable(Protocol):
+    async def read(self, size: int = -1) -> bytes:
+        ...
+
+
+async def iter_text(file: AsyncReadable) -> AsyncIterator[str]:
+    """ yields decoded (utf-8) chunks of file """
+
+    decode = codecs.getincrementaldecoder('utf-8')().decode
+    try:
+        while chunk := await file.read(CHUNK_SIZE):
+            yield decode(chunk)
+        yield decode(b'', final=True)
+    except UnicodeDecodeError as exc:
+        raise JSONStreamError(f'Invalid utf-8: {exc}')
+
+
+async def iter_jsonl(file: AsyncReadable) -> AsyncIterator[tuple[str, Any]]:
+    """
+    reads JSON Lines with one single key object per line
+    {"role": {...}} -> yields ('role', {...})
+    """
+
+    line_no = 0
+    rest = ''
+
+    def parse(line: str) -> tuple[str, Any] | None:
+        if line.strip() == '':
+            return None
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise JSONStreamError(f'Line {line_no}: {exc}')
+        if not isinstance(entry, dict) or len(entry) != 1:
+            raise JSONStreamError(
+                f'Line {line_no}: has to be an object with one key')
+        return next(iter(entry.items()))
+
+    async for text in iter_text(file):
+        *lines, rest = (rest + text).split('\n')
+        for line in lines:
+            line_no += 1
+            if (entry := parse(line)) is not None:
+                yield entry
+
+    line_no += 1
+    if (entry := parse(rest)) is not None:
+        yield entry
+
+
+class _Reader:
+    """ buffered text of a file, refilled while values are decoded """
+
+    def __init__(self, file: AsyncReadable):
+        self._chunks = iter_text(file)
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self) -> None:
+        """ drops consumed text, appends next chunk """
+        try:
+            chunk = await anext(self._chunks)
+        except StopAsyncIteration:
+            self.eof = True
+            return
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+
+    async def peek(self) -> str | None:
+        """ next non whitespace character (not consumed), None at the end """
+        while True:
+            text, pos = self.text, self.pos
+            while pos < len(text) and text[pos] in WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(text):
+                return text[pos]
+            if self.eof:
+                return None
+            await self.fill()
+
+    async def expect(self, chars: str) -> str:
+        """ consumes next character, has to be one of chars """
+        char = await self.peek()
+        if char is None or char not in chars:
+            raise JSONStreamError(
+                f'Expected one of {chars!r}, got {char!r}')
+        self.pos += 1
+        return char
+
+    async def value(self) -> Any:
+        """ decodes next JSON value, reads more text until it is complete """
+        await self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError as exc:
+                if self.eof:
+                    raise JSONStreamError(str(exc))
+                await self.fill()
+                continue
+            if end == len(self.text) and not self.eof:
+                # value might continue in the next chunk (numbers)
+                await self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+async def iter_json(file: AsyncReadable) -> AsyncIterator[tuple[str, Any]]:
+    """
+    reads a JSON object, entries of top level lists one by one
+    {"roles": [r1, r2], "users": [u1]}
+    -> yields ('roles', r1), ('roles', r2), ('users', u1)
+    """
+
+    reader = _Reader(file)
+    await reader.expect('{')
+    if await reader.peek() == '}':
+        return
+
+    while True:
+        key = await reader.value()
+        if not isinstance(key, str):
+            raise JSONStreamError('Object keys have to be strings')
+        await reader.expect(':')
+
+        if await reader.peek() == '[':
+            await reader.expect('[')
+            if await reader.peek() == ']':
+                await reader.expect(']')
+            else:
+                while True:
+                    yield key, await reader.value()
+                    if await reader.expect(',]') == ']':
+                        break
+        else:
+            yield key, await reader.value()
+
+        if await reader.expect(',}') == '}':
+            return
@@ -0,0 +1,266 @@
+"""
+encode/verify JWTs (compact serialization) with parsed cryptography keys
+lean replacement of python-jose on the hot path (signing, validating)
+https://datatracker.ietf.org/doc/html/rfc7519
+"""
+
+import base64
+import binascii
+import json
+from time import time
+from typing import Any, NamedTuple
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import (ec, ed25519, padding,
+                                                       rsa)
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    decode_dss_signature, encode_dss_signature)
+
+# supported signing algorithms
+RS256 = 'RS256'
+ES256 = 'ES256'
+EDDSA = 'EdDSA'
+
+PrivateKey = (
+    rsa.RSAPrivateKey | ec.EllipticCurvePrivateKey | ed25519.Ed25519PrivateKey
+)
+PublicKey = (
+    rsa.RSAPublicKey | ec.EllipticCurvePublicKey | ed25519.Ed25519PublicKey
+)
+
+# byte length of r and s in ES256 (P-256) signatures
+ES256_COORDINATE_SIZE = 32
+
+# claim checks if not overwritten (same defaults as python-jose)
+DEFAULT_OPTIONS = {
+    'verify_signature': True,
+    'verify_aud': True,
+    'verify_iat': True,
+    'verify_exp': True,
+    'verify_nbf': True,
+    'verify_iss': True,
+    'verify_sub': True,
+    'verify_jti': True,
+    'verify_at_hash': True,
+    'leeway': 0,
+}
+
+
+class JWTError(Exception):
+    """ token is malformed, its signature or one of its claims is invalid """
+
+
+class UnverifiedToken(NamedTuple):
+    header: dict            # decoded JOSE header (alg, kid)
+    signing_input: bytes    # header.payload, what the signature covers
+    payload: bytes          # base64url encoded claims
+    signature: bytes        # decoded signature
+
+
+def b64encode(data: bytes) -> bytes:
+    """ base64url encode without padding """
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def b64decode(data: bytes) -> bytes:
+    """ base64url decode, restores missing padding """
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def encode_header(alg: str, kid: str) -> bytes:
+    """
+    returns encoded JOSE header segment
+    (same for every token of a key, compute once per key)
+    """
+    header = {'alg': alg, 'typ': 'JWT', 'kid': kid}
+    return b64encode(json.dumps(header, separators=(',', ':')).encode())
+
+
+def sign(message: bytes, key: PrivateKey, alg: str) -> bytes:
+    """ signs message with private key, returns JWS signature """
+
+    if alg == RS256:
+        return key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+
+    if alg == ES256:
+        # JWS uses raw r || s instead of DER
+        r, s = decode_dss_signature(
+            key.sign(message, ec.ECDSA(hashes.SHA256())))
+        return (
+            r.to_bytes(ES256_COORDINATE_SIZE, 'big')
+            + s.to_bytes(ES256_COORDINATE_SIZE, 'big')
+        )
+
+    if alg == EDDSA:
+        return key.sign(message)
+
+    raise JWTError(f'Unsupported algorithm {alg}')
+
+
+def verify_signature(
+    message: bytes,
+    signature: bytes,
+    key: PublicKey,
+    alg: str
+) -> bool:
+    """ returns true if signature of message matches public key """
+
+    try:
+        if alg == RS256:
+            key.verify(signature, message, padding.PKCS1v15(),
+                       hashes.SHA256())
+        elif alg == ES256:
+            if len(signature) != 2 * ES256_COORDINATE_SIZE:
+                return False
+            r = int.from_bytes(signature[:ES256_COORDINATE_SIZE], 'big')
+            s = int.from_bytes(signature[ES256_COORDINATE_SIZE:], 'big')
+            key.verify(encode_dss_signature(r, s), message,
+                       ec.ECDSA(hashes.SHA256()))
+        elif alg == EDDSA:
+            key.verify(signature, message)
+        else:
+            return False
+    except InvalidSignature:
+        return False
+    return True
+
+
+def encode(header: bytes, payload: bytes, key: PrivateKey, alg: str) -> str:
+    """
+    takes encoded header segment (encode_header) and JSON payload
+    returns signed JWT string
+    """
+
+    signing_input = header + b'.' + b64encode(payload)
+    signature = b64encode(sign(signing_input, key, alg))
+    return (signing_input + b'.' + signature).decode('ascii')
+
+
+def parse(token: str) -> UnverifiedToken:
+    """
+    splits JWT into its segments, decodes header and signature
+    nothing is verified yet, use decode afterwards
+    Failure: raises JWTError
+    """
+
+    try:
+        token = token.encode('ascii')
+        signing_input, signature = token.rsplit(b'.', 1)
+        header, payload = signing_input.split(b'.', 1)
+        header = json.loads(b64decode(header))
+        signature = b64decode(signature)
+    except (ValueError, binascii.Error) as exc:
+        # includes unicode and json decode errors
+        raise JWTError(f'Malformed token: {exc}')
+
+    if not isinstance(header, dict):
+        raise JWTError('Invalid header: must be a json object')
+
+    return UnverifiedToken(header, signing_input, payload, signature)
+
+
+def _numeric_claim(claims: dict, name: str) -> int:
+    try:
+        return int(claims[name])
+    except (TypeError, ValueError):
+        raise JWTError(f'{name} claim must be an integer')
+
+
+def validate_claims(
+    claims: dict,
+    audience: str | None,
+    options: dict[str, Any]
+) -> None:
+    """
+    checks registered claims like python-jose with the same options
+    (verify_<claim>, require_<claim>, leeway)
+    Failure: raises JWTError
+    """
+
+    leeway = options.get('leeway', 0)
+    verify = {
+        name[len('verify_'):]
+        for name, enabled in options.items()
+        if name.startswith('verify_') and enabled
+    }
+
+    # required claims are always verified
+    for name, enabled in options.items():
+        if not name.startswith('require_') or not enabled:
+            continue
+        claim = name[len('require_'):]
+        if claim not in claims:
+            raise JWTError(f'missing required key "{claim}" among claims')
+        verify.add(claim)
+
+    now = int(time())
+
+    if 'iat' in verify and 'iat' in claims:
+        _numeric_claim(claims, 'iat')
+
+    if 'nbf' in verify and 'nbf' in claims:
+        if _numeric_claim(claims, 'nbf') > now + leeway:
+            raise JWTError('The token is not yet valid (nbf)')
+
+    if 'exp' in verify and 'exp' in claims:
+        if _numeric_claim(claims, 'exp') < now - leeway:
+            raise JWTError('Signature has expired')
+
+    if 'aud' in verify and 'aud' in claims:
+        aud = claims['aud']
+        aud = [aud] if isinstance(aud, str) else aud
+        if (
+            not isinstance(aud, list)
+            or any(not isinstance(entry, str) for entry in aud)
+        ):
+            raise JWTError('Invalid claim format in token')
+        if audience not in aud:
+            raise JWTError('Invalid audience')
+
+    if 'sub' in verify and 'sub' in claims:
+        if not isinstance(claims['sub'], str):
+            raise JWTError('Subject must be a string')
+
+    if 'jti' in verify and 'jti' in claims:
+        if not isinstance(claims['jti'], str):
+            raise JWTError('JWT ID must be a string')
+
+    if 'at_hash' in verify and 'at_hash' in claims:
+        # tokens of this service never carry an access token hash
+        raise JWTError('No access_token provided to compare against at_hash')
+
+
+def decode(
+    token: UnverifiedToken,
+    key: PublicKey,
+    alg: str,
+    audience: str | None = None,
+    options: dict[str, Any] | None = None
+) -> dict:
+    """
+    verifies signature (only given alg is accepted) and claims of token
+    Success: returns claims
+    Failure: raises JWTError
+    """
+
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+
+    if options['verify_signature']:
+        if token.header.get('alg') != alg:
+            raise JWTError('The specified alg value is not allowed')
+        if not verify_signature(token.signing_input, token.signature,
+                                key, alg):
+            raise JWTError('Signature verification failed')
+
+    try:
+        claims = json.loads(b64decode(token.payload))
+    except (ValueError, binascii.Error) as exc:
+        raise JWTError(f'Invalid payload string: {exc}')
+
+    if not isinstance(claims, dict):
+        raise JWTError('Invalid payload string: must be a json object')
+
+    validate_claims(claims, audience, options)
+
+    return claims
@@ -0,0 +1,224 @@
+""" generate key pairs, in memory store of parsed signing keys """
+
+import random
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import NamedTuple
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jose import jwk
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+from jose.utils import base64url_encode
+
+from .. import schemas
+from .jwt_codec import (EDDSA, ES256, RS256, PrivateKey, PublicKey,
+                        encode_header)
+
+# key types of the signing algorithms
+KEY_TYPES = {
+    RS256: (rsa.RSAPrivateKey, rsa.RSAPublicKey),
+    ES256: (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey),
+    EDDSA: (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey),
+}
+
+
+class Ed25519Key(Key):
+    """
+    EdDSA (Ed25519) key for python-jose, which does not support it itself
+    https://datatracker.ietf.org/doc/html/rfc8037
+    """
+
+    def __init__(self, key, algorithm):
+        if algorithm != EDDSA:
+            raise JWKError(f'{algorithm} is not a valid EdDSA algorithm')
+        self._algorithm = algorithm
+
+        if isinstance(key, (ed25519.Ed25519PrivateKey,
+                            ed25519.Ed25519PublicKey)):
+            self.prepared_key = key
+            return
+
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        if b'PRIVATE' in key:
+            key = serialization.load_pem_private_key(key, password=None)
+        else:
+            key = serialization.load_pem_public_key(key)
+        if not isinstance(key, (ed25519.Ed25519PrivateKey,
+                                ed25519.Ed25519PublicKey)):
+            raise JWKError('Not an Ed25519 key')
+        self.prepared_key = key
+
+    def is_public(self) -> bool:
+        return isinstance(self.prepared_key, ed25519.Ed25519PublicKey)
+
+    def sign(self, msg: bytes) -> bytes:
+        return self.prepared_key.sign(msg)
+
+    def verify(self, msg: bytes, sig: bytes) -> bool:
+        try:
+            self.public_key().prepared_key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key(self) -> 'Ed25519Key':
+        if self.is_public():
+            return self
+        return self.__class__(self.prepared_key.public_key(), self._algorithm)
+
+    def to_dict(self) -> dict:
+        raw = self.public_key().prepared_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return {
+            'alg': self._algorithm,
+            'kty': 'OKP',
+            'crv': 'Ed25519',
+            'x': base64url_encode(raw).decode('ASCII'),
+        }
+
+
+jwk.register_key(EDDSA, Ed25519Key)
+
+
+def generate_private_key(algorithm: str) -> PrivateKey:
+    """ generates a new private key for the given signing algorithm """
+
+    if algorithm == RS256:
+        PUBLIC_EXPONENT = 65537
+        KEY_SIZE = 2048
+        return rsa.generate_private_key(
+            public_exponent=PUBLIC_EXPONENT,
+            key_size=KEY_SIZE,
+        )
+
+    if algorithm == ES256:
+        return ec.generate_private_key(ec.SECP256R1())
+
+    if algorithm == EDDSA:
+        return ed25519.Ed25519PrivateKey.generate()
+
+    raise JWKError(f'Unsupported signing algorithm {algorithm}')
+
+
+def generate_key_pair(algorithm: str) -> tuple[bytes, bytes]:
+    """
+    Generates a new key pair for the given signing algorithm
+    (cpu heavy for rsa, run it in a thread)
+    returns PEM encoded private and public key
+    """
+
+    # generate private/secret key
+    private_key = generate_private_key(algorithm)
+
+    # save private/secret key as PEM
+    private_key_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+    # generate public key
+    public_key = private_key.public_key()
+
+    # save public key as PEM
+    public_key_pem = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    return private_key_pem, public_key_pem
+
+
+def load_private_key(pem: str | bytes, algorithm: str) -> PrivateKey:
+    """ parses PEM encoded private key, checks it fits the algorithm """
+
+    if isinstance(pem, str):
+        pem = pem.encode('utf-8')
+    key = serialization.load_pem_private_key(pem, password=None)
+    if not isinstance(key, KEY_TYPES[algorithm][0]):
+        raise JWKError(f'Not a private key for {algorithm}')
+    return key
+
+
+def load_public_key(pem: str | bytes, algorithm: str) -> PublicKey:
+    """ parses PEM encoded public key, checks it fits the algorithm """
+
+    if isinstance(pem, str):
+        pem = pem.encode('utf-8')
+    key = serialization.load_pem_public_key(pem)
+    if not isinstance(key, KEY_TYPES[algorithm][1]):
+        raise JWKError(f'Not a public key for {algorithm}')
+    return key
+
+
+class VerificationKey(NamedTuple):
+    alg: str                # algorithm the key pair signs with
+    public_key: PublicKey   # parsed public key, ready for validation
+
+
+class SigningKey(NamedTuple):
+    kid: str                # Key ID
+    alg: str                # algorithm used for signing
+    private_key: PrivateKey  # parsed private key, ready for signing
+    header: bytes           # encoded JWT header segment (alg, kid)
+    retire_at: datetime     # key must not sign tokens after this date
+
+
+class SigningKeyRing:
+    """
+    Holds parsed private keys of all valid key pairs
+    - load: parses the private keys of the given key pairs once
+    - choose: picks a random key that did not retire yet
+    - invalidate: forces reload on next use (rotation, deletion)
+    keys get reloaded after refresh_interval seconds,
+    so changes made by other processes are picked up as well
+    keys stop signing grace before their key pair expires,
+    so every token signed with them stays valid until its own expiry
+    """
+
+    def __init__(self, refresh_interval: float, grace: timedelta):
+        self.refresh_interval = refresh_interval
+        self.grace = grace
+        self._keys: list[SigningKey] = []
+        self._loaded_at: float | None = None
+
+    @property
+    def stale(self) -> bool:
+        """ true if keys have to be (re)loaded from db """
+        if self._loaded_at is None:
+            return True
+        return monotonic() - self._loaded_at > self.refresh_interval
+
+    def load(self, key_pairs: list[schemas.KeyPair]) -> None:
+        """ parses private keys of given key pairs and stores them """
+        self._keys = [
+            SigningKey(
+                kid=key_pair.kid,
+                alg=key_pair.alg,
+                private_key=load_private_key(
+                    key_pair.private_key, key_pair.alg),
+                header=encode_header(key_pair.alg, key_pair.kid),
+                retire_at=key_pair.exp - self.grace
+            )
+            for key_pair in key_pairs
+        ]
+        self._loaded_at = monotonic()
+
+    def choose(self) -> SigningKey | None:
+        """ returns a random valid key, None if there is no valid key """
+        now = datetime.utcnow()
+        keys = [key for key in self._keys if key.retire_at > now]
+        if len(keys) == 0:
+            return None
+        return random.choice(keys)
+
+    def invalidate(self) -> None:
+        """ drops all keys, next use reloads them """
+        self._keys = []
+        self._loaded_at = None
@@ -1,6 +1,13 @@
+import atexit
+import json
+from datetime import datetime, timezone
 from logging import Formatter, getLogger
-from logging import Logger, StreamHandler
+from logging import Handler, Logger, LogRecord, StreamHandler
 from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 class DefaultFormatter(Formatter):
@@ -36,39 +43,104 @@ class DefaultFormatter(Formatter):
         CRITICAL: BOLD_RED + FORM + RESET
     }
 
-    def format(self, record):
-        """custom format. calls default format method"""
+    def __init__(self):
+        super().__init__(self.FORM, datefmt=DATE_FORMAT)
+        # one formatter per level, created once
+        self.formatters = {
+            level: Formatter(log_fmt, datefmt=DATE_FORMAT)
+            for level, log_fmt in self.FORMATS.items()
+        }
 
-        # generate logging format string
-        log_fmt = self.FORMATS.get(record.levelno)
+    def format(self, record):
+        """custom format. uses formatter of the records level"""
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
+        return formatter.format(record)
 
-        # get default logging formatter with new date format
-        formatter = Formatter(log_fmt, datefmt="%Y-%m-%d %H:%M:%S")
 
-        # call default formatter
-        return formatter.format(record)
+class JSONFormatter(Formatter):
+    """structured logging, one JSON object per line (log collectors)"""
 
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'file': record.filename,
+            'line': record.lineno,
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+FORMATTERS = {
+    'text': DefaultFormatter,
+    'json': JSONFormatter,
+}
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    puts records into a queue, a background thread writes them
+    to target -> logging never waits for the console / log file
+    """
 
-def get_logger(name: str, level: int | str) -> Logger:
+    def __init__(self, target: Handler):
+        super().__init__(SimpleQueue())
+        self.target = target
+        self.listener = QueueListener(
+            self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        # write queued records before the process exits
+        atexit.register(self.close)
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # message is rendered now (args may change later),
+        # formatting is left to the background thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def close(self) -> None:
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+def get_logger(name: str, level: int | str, fmt: str = 'text') -> Logger:
     """Configures logging"""
 
     # create logger
     logger = getLogger(name)
 
-    # set logging level
-    logger.setLevel(level)
-
-    # create handler that prints to console
+    # create handler that prints to console (in a background thread)
     handler = StreamHandler()
-    handler.setLevel(level)
-    handler.setFormatter(DefaultFormatter())
+    handler.setFormatter(FORMATTERS[fmt]())
 
     # add handler to logger
-    logger.addHandler(handler)
+    logger.addHandler(BackgroundHandler(handler))
+
+    configure_logger(logger, level, fmt)
 
     return logger
 
 
+def configure_logger(logger: Logger, level: int | str, fmt: str) -> None:
+    """Sets level and output format (text, json) of logger"""
+
+    if isinstance(level, str):
+        level = level.upper()
+    logger.setLevel(level)
+
+    for handler in logger.handlers:
+        if isinstance(handler, BackgroundHandler):
+            handler.target.setFormatter(FORMATTERS[fmt]())
+
+
 def test_logger(logger: Logger) -> None:
     """tests logging output"""
     logger.debug('This is the debug logger')
@@ -0,0 +1,247 @@
+"""
+in-process metrics in the prometheus text format (GET /metrics)
+counters, histograms and gauges are kept per worker process
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import functools
+import inspect
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Iterable
+
+# latency buckets in seconds (0.1ms - 10s)
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if len(names) == 0:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value)
+            .replace('\\', r'\\')
+            .replace('"', r'\"')
+            .replace('\n', r'\n')
+        )
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ base of all metrics, knows name, help text and label names """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        """ returns (name, formatted labels, value) of all samples """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    value that only goes up (requests, cache hits, failures)
+    - inc: adds amount to the counter of the given label values
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = (
+                self._values.get(labelvalues, 0) + amount)
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        for labelvalues, value in sorted(self._values.items()):
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield self.name, labels, value
+
+
+class _Timer:
+    """ context manager, observes the seconds spent inside """
+
+    __slots__ = ('_histogram', '_labelvalues', '_start')
+
+    def __init__(self, histogram: 'Histogram', labelvalues: tuple[str, ...]):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+
+    def __enter__(self) -> '_Timer':
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(
+            perf_counter() - self._start, *self._labelvalues)
+
+
+class Histogram(Metric):
+    """
+    distribution of observed values (latencies) in fixed buckets
+    - observe: counts value in its bucket (per label values)
+    - time: context manager, observes the seconds spent inside
+    """
+
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [counts per bucket (+Inf last), sum]
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[labelvalues] = entry
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labelvalues: str) -> _Timer:
+        return _Timer(self, labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        entry = self._values.get(labelvalues)
+        return 0 if entry is None else sum(entry[0])
+
+    def samples(self):
+        labelnames = self.labelnames + ('le',)
+        for labelvalues, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(
+                    labelnames, labelvalues + (_format_value(bound),))
+                yield f'{self.name}_bucket', labels, cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Gauge(Metric):
+    """
+    current value, read from a callback when metrics are collected
+    (pool usage, queue depth), so it costs nothing meanwhile
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, func: Callable[[], float]):
+        super().__init__(name, help)
+        self.func = func
+
+    def samples(self):
+        yield self.name, '', self.func()
+
+
+class Registry:
+    """ collection of metrics rendered together by GET /metrics """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(
+            metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+# seconds spent in each stage of login, token validation and signing
+stage_seconds: Histogram = registry.register(Histogram(
+    'authopie_stage_duration_seconds',
+    'Seconds spent in a stage of request processing',
+    labelnames=('stage',)
+))
+
+# seconds per executed database statement
+db_query_seconds: Histogram = registry.register(Histogram(
+    'authopie_db_query_duration_seconds',
+    'Seconds spent executing database statements'
+))
+
+# lookups of the in-process caches (utils/cache.py)
+cache_requests: Counter = registry.register(Counter(
+    'authopie_cache_requests_total',
+    'Lookups of in-process caches',
+    labelnames=('cache', 'result')
+))
+
+# rejected requests (401 Unauthorized / 403 Forbidden)
+auth_failures: Counter = registry.register(Counter(
+    'authopie_auth_failures_total',
+    'Requests rejected by authentication or authorization',
+    labelnames=('status', 'reason')
+))
+
+
+def stage(name: str) -> _Timer:
+    """ context manager, times a stage (authopie_stage_duration_seconds) """
+    return stage_seconds.time(name)
+
+
+def timed(name: str) -> Callable:
+    """ decorator, times every call of a (async) function as a stage """
+
+    def decorator(func: Callable) -> Callable:
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage_seconds.time(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_seconds.time(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,90 @@
+"""
+keyset (cursor) pagination for list endpoints
+a cursor holds the sort key of the last row of a page, the next page
+starts right after it (index range scan, no OFFSET)
+"""
+
+import base64
+import binascii
+import json
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ColumnElement, text
+from sqlalchemy.sql.schema import Index
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from ..exceptions import InvalidCursorException
+
+
+class ByteOrder(ColumnElement):
+    """
+    column compared by code point (byte order) instead of its collation
+    SQLite compares like this anyway (BINARY), PostgreSQL needs COLLATE "C"
+    """
+
+    inherit_cache = True
+    _traverse_internals = [('column', InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, column: ColumnElement):
+        self.column = column
+        self.type = column.type
+
+
+@compiles(ByteOrder)
+def _compile_byte_order(element, compiler, **kw):
+    return compiler.process(element.column, **kw)
+
+
+@compiles(ByteOrder, 'postgresql')
+def _compile_byte_order_postgresql(element, compiler, **kw):
+    return f'{compiler.process(element.column, **kw)} COLLATE "C"'
+
+
+def encode_cursor(*values) -> str:
+    """ opaque cursor (urlsafe base64) of the sort key values """
+    data = json.dumps([str(value) for value in values],
+                      separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, length: int) -> list[str]:
+    """
+    Success: returns the sort key values of cursor
+    Failure (malformed cursor): raises InvalidCursorException
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        raise InvalidCursorException()
+    if (not isinstance(values, list) or len(values) != length
+            or not all(isinstance(value, str) for value in values)):
+        raise InvalidCursorException()
+    return values
+
+
+def prefix_index(name: str, column: str) -> Index:
+    """
+    index for the prefix_filter range of column on PostgreSQL
+    (compared by code point, the plain index uses the db collation)
+    """
+    return Index(name, text(f'"{column}" COLLATE "C"')).ddl_if(
+        dialect='postgresql')
+
+
+def prefix_filter(column: ColumnElement, prefix: str) -> list:
+    """
+    clauses matching values starting with prefix
+    prefix <= value < next prefix uses the index of column
+    (PostgreSQL: prefix_index), LIKE only filters the rows of that range
+    the range is compared by code point, with a linguistic collation
+    (e.g. en_US.UTF-8) prefixes with punctuation or mixed case would
+    miss rows
+    """
+    ordered = ByteOrder(column)
+    clauses = [ordered >= prefix, column.startswith(prefix, autoescape=True)]
+    # smallest string after all strings starting with prefix
+    stripped = prefix.rstrip(chr(0x10FFFF))
+    if stripped != '':
+        clauses.append(ordered < stripped[:-1] + chr(ord(stripped[-1]) + 1))
+    return clauses
@@ -0,0 +1,68 @@
+""" base class of background services running periodically """
+
+import asyncio
+
+from .. import logger
+
+
+class PeriodicService:
+    """
+    Runs run_once every interval seconds in the background
+    - start: starts the service (on app startup), interval <= 0 disables it
+    - wake: run now instead of at the end of the interval
+    - stop: stops the service (on app shutdown)
+    failed runs are logged, the next run tries again
+    """
+
+    # name of the task in error logs
+    name = 'Periodic task'
+
+    # run once right after start or only after the first interval
+    run_on_start = True
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._task is not None:
+            return
+        # bound to the loop of the app (tests may start it more than once)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self) -> None:
+        raise NotImplementedError
+
+    async def _wait(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run(self) -> None:
+        if not self.run_on_start:
+            await self._wait()
+        while True:
+            try:
+                await self.run_once()
+            except Exception as exc:
+                # keep service alive, next run tries again
+                logger.error(f'{self.name} failed: {exc!r}')
+            await self._wait()
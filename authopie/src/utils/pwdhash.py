@@ -1,9 +1,52 @@
 """ hash password, compare password to hash from db """
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
+from .. import config
+from . import metrics
+
 ctx = CryptContext(schemes=["bcrypt"], deprecated=["auto"])
 
+# bcrypt runs in its own worker threads, so it doesnt block the event loop
+executor = ThreadPoolExecutor(
+    max_workers=config.PWDHASH_WORKERS,
+    thread_name_prefix='pwdhash'
+)
+
+# number of hash/verify calls that wait for or run in a worker
+_pending = 0
+
+
+def queue_depth() -> int:
+    """
+    returns how many hash/verify calls are waiting for a free worker
+    """
+    return max(_pending - config.PWDHASH_WORKERS, 0)
+
+
+metrics.registry.register(metrics.Gauge(
+    'authopie_pwdhash_queue_depth',
+    'Password hash/verify calls waiting for a bcrypt worker',
+    queue_depth
+))
+
+
+async def _run(func, *args):
+    """
+    runs func in the bcrypt worker pool and awaits its result
+    """
+    global _pending
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        with metrics.stage('bcrypt'):
+            return await loop.run_in_executor(executor, func, *args)
+    finally:
+        _pending -= 1
+
 
 def verify_password(plain_password, hashed_password):
     return ctx.verify(plain_password, hashed_password)
@@ -11,3 +54,11 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     return ctx.hash(password)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await _run(get_password_hash, password)
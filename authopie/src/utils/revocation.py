@@ -0,0 +1,169 @@
+"""
+token revocation by jti
+revoked tokens are stored in db (revoked_token), every worker keeps a
+bloom filter of them in memory: tokens not in the filter (almost all)
+are accepted without a db query, only filter hits are checked in db
+"""
+
+import hashlib
+import math
+import uuid
+from datetime import datetime, timedelta
+from time import monotonic
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import config, crud, logger, schemas
+from ..dependencies import database
+from ..exceptions import TokenValidationFailedException
+from .periodic import PeriodicService
+
+# rows loaded from db at a time while rebuilding the filter
+LOAD_BATCH_SIZE = 1000
+
+# tokens revoked shortly before the last refresh are loaded again
+# (other workers may commit after the refresh read the table)
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+class BloomFilter:
+    """
+    Set of jtis with false positives but no false negatives
+    - add: adds jti
+    - in: False -> never added, True -> probably added
+    sized for capacity jtis at error_rate false positives,
+    needs ~1.2 byte per jti at 0.1%
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(capacity, 1)
+        # optimal number of bits and hash functions
+        self.size = math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.count = 0
+
+    def _indexes(self, jti: uuid.UUID):
+        # k indexes from two hashes (double hashing)
+        digest = hashlib.blake2b(jti.bytes, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, jti: uuid.UUID) -> None:
+        for index in self._indexes(jti):
+            self.bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, jti: uuid.UUID) -> bool:
+        if self.count == 0:
+            return False
+        bits = self.bits
+        return all(
+            bits[index >> 3] & (1 << (index & 7))
+            for index in self._indexes(jti)
+        )
+
+
+class RevocationService(PeriodicService):
+    """
+    Keeps the bloom filter of revoked tokens in sync with the db
+    - load: builds filter from db (on app startup)
+    - start: loads tokens revoked by other workers every interval seconds,
+      deletes expired ones and rebuilds the filter every prune_interval
+    - stop: stops the service (on app shutdown)
+    - revoke: revokes token (db + filter of this worker)
+    - is_revoked: filter check, db lookup only if the filter matches
+    tokens revoked by other workers are accepted for up to interval seconds
+    """
+
+    name = 'Refreshing revoked tokens'
+
+    # the filter is loaded on startup already
+    run_on_start = False
+
+    def __init__(self, interval: float, prune_interval: float):
+        super().__init__(interval)
+        self.prune_interval = prune_interval
+        self.filter = self._new_filter(0)
+        self._refreshed_at = datetime.utcnow()
+        self._pruned_at = monotonic()
+
+    @staticmethod
+    def _new_filter(count: int) -> BloomFilter:
+        # room for twice the current tokens before it has to grow
+        return BloomFilter(
+            max(config.REVOCATION_FILTER_CAPACITY, 2 * count),
+            config.REVOCATION_FILTER_ERROR_RATE
+        )
+
+    async def load(self) -> None:
+        """ rebuilds filter from all revoked tokens that did not expire """
+
+        refreshed_at = datetime.utcnow()
+        jtis = []
+        async with database.SessionLocal() as db:
+            async for batch in crud.stream_revoked_jtis(LOAD_BATCH_SIZE, db):
+                jtis.extend(batch)
+
+        bloom = self._new_filter(len(jtis))
+        for jti in jtis:
+            bloom.add(jti)
+        # tokens revoked meanwhile are added by the next refresh
+        self.filter, self._refreshed_at = bloom, refreshed_at
+        self._pruned_at = monotonic()
+
+    async def refresh(self) -> None:
+        """ adds tokens revoked since the last refresh (other workers) """
+
+        refreshed_at = datetime.utcnow()
+        async with database.SessionLocal() as db:
+            jtis = await crud.get_revoked_jtis_since(
+                self._refreshed_at - REFRESH_OVERLAP, db)
+        for jti in jtis:
+            if jti not in self.filter:
+                self.filter.add(jti)
+        self._refreshed_at = refreshed_at
+
+    async def prune(self) -> None:
+        """ deletes expired tokens, rebuilds the filter without them """
+
+        async with database.SessionLocal() as db:
+            await crud.delete_expired_revoked_tokens(db)
+        await self.load()
+
+    async def revoke(self, token: schemas.Token, db: AsyncSession) -> None:
+        """
+        revokes given (validated) token
+        Success: returns None
+        Failure (token has no jti): raises TokenValidationFailedException
+        """
+
+        if token.jti is None:
+            logger.warning('Token without jti can not be revoked')
+            raise TokenValidationFailedException
+
+        await crud.revoke_token(token, db)
+        self.filter.add(token.jti)
+
+    async def is_revoked(self, token: schemas.Token, db: AsyncSession) -> bool:
+        """ True if token was revoked, False otherwise """
+
+        if token.jti is None or token.jti not in self.filter:
+            return False
+        # revoked or a false positive of the filter
+        return await crud.is_token_revoked(token.jti, db)
+
+    async def run_once(self) -> None:
+        if (monotonic() - self._pruned_at >= self.prune_interval
+                or self.filter.count > self.filter.capacity):
+            await self.prune()
+        else:
+            await self.refresh()
+
+
+revocation = RevocationService(
+    config.REVOCATION_REFRESH_INTERVAL,
+    config.REVOCATION_PRUNE_INTERVAL
+)
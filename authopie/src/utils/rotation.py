@@ -0,0 +1,27 @@
+""" background service that keeps key pairs rotated """
+
+from .. import config, crud
+from ..dependencies import database
+from .periodic import PeriodicService
+
+
+class KeyRotationService(PeriodicService):
+    """
+    Runs crud.rotate_key_pairs every interval seconds in the background
+    (start/stop on app startup/shutdown, wake after a key pair was deleted)
+    key generation happens here, so requests never have to wait for it
+    """
+
+    name = 'Key rotation'
+
+    async def rotate(self) -> None:
+        """ rotates key pairs once, only one worker at a time """
+        async with database.bootstrap_lock():
+            async with database.SessionLocal() as db:
+                await crud.rotate_key_pairs(db)
+
+    async def run_once(self) -> None:
+        await self.rotate()
+
+
+rotation = KeyRotationService(config.KEY_ROTATION_INTERVAL)
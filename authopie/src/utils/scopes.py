@@ -0,0 +1,109 @@
+"""
+scope compiler: scope strings of roles are parsed once into frozensets
+of interned scopes, cached by their source string
+effective scopes of a user (union over its roles) are cached per role set,
+so issuing tokens and authorizing never split strings again
+
+scopes are hierarchical: billing:invoices:read
+wildcard grants stay compact in tokens and are matched by a prefix trie:
+billing:* grants every scope below billing, * grants every scope
+"""
+
+import sys
+from functools import lru_cache
+from typing import Iterable
+
+# distinct scope strings / role sets kept compiled in memory
+CACHE_SIZE = 4096
+
+# separates the segments of a scope (billing:invoices:read)
+SEPARATOR = ':'
+
+# alone: grants every scope, as last segment: every scope below
+WILDCARD = '*'
+
+# segments of letters, digits, _ . - optionally ending with :*, or * alone
+SCOPE_PATTERN = r'^(\*|[A-Za-z0-9_.\-]+(:[A-Za-z0-9_.\-]+)*(:\*)?)$'
+
+# trie node key marking a wildcard grant (empty segments are invalid)
+_GRANTS_BELOW = ''
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_scopes(scopes: str | None) -> frozenset[str]:
+    """ 'a b c' (scopes of a role) -> frozenset of interned scopes """
+    if not scopes:
+        return frozenset()
+    return frozenset(sys.intern(scope) for scope in scopes.split())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _union(role_scopes: tuple[str | None, ...]) -> frozenset[str]:
+    return frozenset().union(*map(compile_scopes, role_scopes))
+
+
+def effective_scopes(roles: Iterable) -> frozenset[str]:
+    """ all scopes granted by given roles (RoleInDB), cached per role set """
+    return _union(tuple(sorted(role.scopes or '' for role in roles or ())))
+
+
+def granting_scopes(scope: str) -> list[str]:
+    """
+    scopes that grant scope: itself, wildcards above it and *
+    billing:invoices:read -> billing:invoices:read, billing:invoices:*,
+    billing:*, *
+    """
+    segments = scope.split(SEPARATOR)
+    granting = {scope, WILDCARD}
+    for end in range(1, len(segments)):
+        granting.add(SEPARATOR.join(segments[:end] + [WILDCARD]))
+    return sorted(granting)
+
+
+class ScopeMatcher:
+    """
+    Granted scopes compiled for checking required scopes
+    - exact grants: set lookup
+    - wildcard grants (billing:*): prefix trie of their segments,
+      a check walks at most as many nodes as the scope has segments
+    cost does not depend on the number of granted scopes
+    """
+
+    __slots__ = ('exact', 'everything', 'trie')
+
+    def __init__(self, granted: frozenset[str]):
+        self.exact = granted
+        self.everything = WILDCARD in granted
+        # segment -> child node, _GRANTS_BELOW marks a wildcard grant
+        self.trie: dict = {}
+        for scope in granted:
+            if not scope.endswith(SEPARATOR + WILDCARD):
+                continue
+            node = self.trie
+            for segment in scope.split(SEPARATOR)[:-1]:
+                node = node.setdefault(segment, {})
+            node[_GRANTS_BELOW] = True
+
+    def grants(self, scope: str) -> bool:
+        """ True if scope is granted (exact, by a wildcard or by *) """
+
+        if self.everything or scope in self.exact:
+            return True
+        if not self.trie:
+            return False
+
+        # a:* grants everything below a (a:b, a:b:c, a:*), not a itself
+        node = self.trie
+        for segment in scope.split(SEPARATOR)[:-1]:
+            node = node.get(segment)
+            if node is None:
+                return False
+            if _GRANTS_BELOW in node:
+                return True
+        return False
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_matcher(granted: frozenset[str]) -> ScopeMatcher:
+    """ matcher for granted scopes, built once per distinct scope set """
+    return ScopeMatcher(granted)
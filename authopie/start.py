@@ -6,12 +6,17 @@ from .src import config
 
 def main():
 
+    # reloader only works with a single process (development)
+    workers = 1 if config.RELOAD else config.WORKERS
+
     uvicorn.run(
         "authopie.src.main:app",
         host=config.HOST,
         port=config.PORT,
-        reload=True,
-        log_level='debug',
+        reload=config.RELOAD,
+        workers=workers,
+        timeout_graceful_shutdown=config.GRACEFUL_SHUTDOWN_TIMEOUT,
+        log_level=config.LOG_LEVEL,
         proxy_headers=True,
         forwarded_allow_ips="*"
     )
@@ -0,0 +1,121 @@
+"""
+microbenchmark: sign/validate tokens with python-jose vs utils/jwt_codec
+run from repo root (needs config.json): python -m benchmarks.jwt_codec
+"""
+
+import argparse
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from jose import jws, jwk, jwt
+
+from authopie.src import config, schemas
+from authopie.src.utils import jwt_codec, keys
+from authopie.src.utils.auth import options
+
+ALGORITHMS = (keys.RS256, keys.ES256, keys.EDDSA)
+KID = 'benchmark'
+
+
+def jose_pem_paths(private_pem: bytes, public_pem: bytes, alg: str):
+    """ python-jose, PEM parsed on every call (original path) """
+
+    def encode(token: schemas.Token) -> str:
+        payload = jsonable_encoder(token, exclude=['user'])
+        return jwt.encode(payload, private_pem, algorithm=alg,
+                          headers=dict(kid=KID))
+
+    def decode(token: str) -> dict:
+        jws.get_unverified_header(token)
+        return jwt.decode(token, public_pem, algorithms=[alg],
+                          audience=config.AUD, options=options)
+
+    return encode, decode
+
+
+def jose_key_paths(private_pem: bytes, public_pem: bytes, alg: str):
+    """ python-jose with pre-parsed keys """
+
+    private_key = jwk.construct(private_pem, alg)
+    public_key = jwk.construct(public_pem, alg)
+
+    def encode(token: schemas.Token) -> str:
+        payload = jsonable_encoder(token, exclude=['user'])
+        return jwt.encode(payload, private_key, algorithm=alg,
+                          headers=dict(kid=KID))
+
+    def decode(token: str) -> dict:
+        jws.get_unverified_header(token)
+        return jwt.decode(token, public_key, algorithms=[alg],
+                          audience=config.AUD, options=options)
+
+    return encode, decode
+
+
+def codec_paths(private_pem: bytes, public_pem: bytes, alg: str):
+    """ utils/jwt_codec with pre-parsed cryptography keys (current path) """
+
+    private_key = keys.load_private_key(private_pem, alg)
+    public_key = keys.load_public_key(public_pem, alg)
+    header = jwt_codec.encode_header(alg, KID)
+
+    def encode(token: schemas.Token) -> str:
+        payload = token.json(exclude={'user'}).encode()
+        return jwt_codec.encode(header, payload, private_key, alg)
+
+    def decode(token: str) -> dict:
+        unverified = jwt_codec.parse(token)
+        return jwt_codec.decode(unverified, public_key, alg,
+                                audience=config.AUD, options=options)
+
+    return encode, decode
+
+
+PATHS = {
+    'jose (pem)': jose_pem_paths,
+    'jose (parsed key)': jose_key_paths,
+    'jwt_codec': codec_paths,
+}
+
+
+def measure(func, arg, number: int) -> float:
+    """ returns microseconds per call (best of 3) """
+    timer = timeit.Timer(lambda: func(arg))
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help='calls per measurement')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    token = schemas.Token(exp=2**31, sub='benchmark@authopie.com',
+                          scopes=['authopie:user:read', 'authopie:role:read'])
+
+    results = []
+    print(f'{"alg":<7} {"path":<18} {"encode µs":>10} {"decode µs":>10}')
+    for alg in ALGORITHMS:
+        private_pem, public_pem = keys.generate_key_pair(alg)
+        for name, paths in PATHS.items():
+            encode, decode = paths(private_pem, public_pem, alg)
+            encoded = encode(token)
+            result = dict(
+                alg=alg,
+                path=name,
+                encode_us=measure(encode, token, args.number),
+                decode_us=measure(decode, encoded, args.number),
+            )
+            results.append(result)
+            print(f'{alg:<7} {name:<18} {result["encode_us"]:>10.1f} '
+                  f'{result["decode_us"]:>10.1f}')
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+benchmark suite: token issuance, validation and login throughput
+runs in-process against the FastAPI app with a temporary SQLite database
+run from repo root (needs config.json): python -m benchmarks.suite
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+from http.cookies import SimpleCookie
+from time import perf_counter
+from typing import Awaitable, Callable
+
+# temporary database, has to be set before the app (config) is imported
+TMP_DIR = tempfile.mkdtemp(prefix='authopie-bench-')
+DATABASE_URL = f'sqlite:///{TMP_DIR}/bench.db'
+os.environ['DATABASE_URL'] = DATABASE_URL
+# no background key rotation while measuring
+os.environ['KEY_ROTATION_INTERVAL'] = '0'
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from authopie.src import config, crud, models  # noqa: E402
+from authopie.src.dependencies import database  # noqa: E402
+from authopie.src.main import app  # noqa: E402
+from authopie.src.utils import pwdhash  # noqa: E402
+
+PASSWORD = 'benchmark'
+ROLES_PER_USER = 3
+# users logged in up front, their tokens are used for refresh/test
+TOKEN_USERS = 16
+
+
+class Context:
+    """ state of one scenario (seeded users, tokens, http client) """
+
+    def __init__(self, client: httpx.AsyncClient, usernames: list[str]):
+        self.client = client
+        self.usernames = usernames
+        self.access_tokens: list[str] = []
+        self.refresh_tokens: list[str] = []
+        self.admin_token: str | None = None
+
+
+def token_cookies(response: httpx.Response) -> tuple[str, str]:
+    """ returns access and refresh token set as cookies by login/refresh """
+    cookie = SimpleCookie()
+    for header in response.headers.get_list('set-cookie'):
+        cookie.load(header)
+    return cookie['access_token'].value, cookie['refresh_token'].value
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str):
+    response = await client.post(
+        '/token', data=dict(username=username, password=password))
+    response.raise_for_status()
+    return token_cookies(response)
+
+
+def bearer(token: str) -> dict:
+    return {'Authorization': f'Bearer {token}'}
+
+
+# endpoint name -> request made with a scenario context
+ENDPOINTS: dict[str, Callable[[Context], Awaitable[httpx.Response]]] = {
+    'POST /token': lambda ctx: ctx.client.post('/token', data=dict(
+        username=random.choice(ctx.usernames), password=PASSWORD)),
+    'POST /token/refresh': lambda ctx: ctx.client.post(
+        '/token/refresh', headers=bearer(random.choice(ctx.refresh_tokens))),
+    'POST /token/test': lambda ctx: ctx.client.post(
+        '/token/test', json=random.choice(ctx.access_tokens)),
+    'GET /.well-known/jwks.json': lambda ctx: ctx.client.get(
+        '/.well-known/jwks.json'),
+    'GET /user': lambda ctx: ctx.client.get(
+        '/user', headers=bearer(ctx.admin_token)),
+}
+
+# endpoints that verify a password (bcrypt) on every request
+LOGIN_ENDPOINTS = {'POST /token'}
+
+
+async def seed(users: int, roles: int) -> list[str]:
+    """
+    inserts roles and users (ROLES_PER_USER random roles each)
+    all users share one password, so it gets hashed only once
+    returns usernames
+    """
+
+    hashed_password = pwdhash.get_password_hash(PASSWORD)
+
+    role_ids = [uuid.uuid4() for _ in range(roles)]
+    role_rows = [
+        dict(id=role_id, name=f'bench-role-{i}', scopes=f'bench-scope-{i}')
+        for i, role_id in enumerate(role_ids)
+    ]
+    user_rows, user_role_rows = [], []
+    for i in range(users):
+        user_id = uuid.uuid4()
+        user_rows.append(dict(
+            id=user_id,
+            username=f'bench-{i}@authopie.com',
+            hashed_password=hashed_password
+        ))
+        for role_id in random.sample(role_ids, min(ROLES_PER_USER, roles)):
+            user_role_rows.append(dict(user_id=user_id, role_id=role_id))
+
+    async with database.SessionLocal() as db:
+        for model, rows in ((models.Role, role_rows),
+                            (models.User, user_rows),
+                            (models.UserRole, user_role_rows)):
+            if len(rows) > 0:
+                await db.execute(insert(model), rows)
+        await db.commit()
+
+    return [row['username'] for row in user_rows]
+
+
+async def measure(
+    ctx: Context,
+    endpoint: str,
+    concurrency: int,
+    requests: int
+) -> dict:
+    """
+    sends requests to endpoint from concurrency parallel clients
+    returns throughput and latency percentiles (ms)
+    """
+
+    request = ENDPOINTS[endpoint]
+    latencies: list[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = perf_counter()
+            response = await request(ctx)
+            latencies.append((perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    # warm up caches and connections
+    await asyncio.gather(*(request(ctx) for _ in range(concurrency)))
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return dict(
+        requests=requests,
+        errors=errors,
+        elapsed_s=round(elapsed, 4),
+        rps=round(requests / elapsed, 2),
+        mean_ms=round(statistics.fmean(latencies), 3),
+        p50_ms=round(percentiles[49], 3),
+        p95_ms=round(percentiles[94], 3),
+        p99_ms=round(percentiles[98], 3),
+        max_ms=round(max(latencies), 3),
+    )
+
+
+async def run_scenario(users: int, roles: int, args) -> list[dict]:
+    """ fresh database with given users/roles, measures all endpoints """
+
+    await database.drop_all()
+    crud.clear_key_caches()
+    crud.clear_principals()
+
+    # startup event: tables, key pair, default role and user
+    await app.router.startup()
+    try:
+        usernames = await seed(users, roles)
+
+        # http:// -> secure cookies are never sent back,
+        # tokens are passed explicitly
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport,
+            base_url='http://authopie.bench'
+        ) as client:
+            ctx = Context(client, usernames)
+            ctx.admin_token, _ = await login(
+                client,
+                config.DEFAULT_USER_USERNAME,
+                config.DEFAULT_USER_PASSWORD
+            )
+            for username in usernames[:TOKEN_USERS]:
+                access_token, refresh_token = await login(
+                    client, username, PASSWORD)
+                ctx.access_tokens.append(access_token)
+                ctx.refresh_tokens.append(refresh_token)
+
+            results = []
+            for endpoint, concurrency in itertools.product(
+                    args.endpoints, args.concurrency):
+                requests = (
+                    args.login_requests if endpoint in LOGIN_ENDPOINTS
+                    else args.requests
+                )
+                result = dict(
+                    endpoint=endpoint,
+                    users=users,
+                    roles=roles,
+                    concurrency=concurrency,
+                    **await measure(ctx, endpoint, concurrency, requests)
+                )
+                results.append(result)
+                print(
+                    f'{endpoint:<28} {users:>6} {roles:>5} {concurrency:>4} '
+                    f'{result["rps"]:>9.1f} {result["p50_ms"]:>8.2f} '
+                    f'{result["p99_ms"]:>8.2f} {result["errors"]:>6}',
+                    file=sys.stderr
+                )
+            return results
+    finally:
+        await app.router.shutdown()
+
+
+def metadata() -> dict:
+    """ environment the results were measured in """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        started_at=datetime.utcnow().isoformat(),
+        commit=commit,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        signing_algorithm=config.SIGNING_ALGORITHM,
+        stateless_auth=config.STATELESS_AUTH,
+        pwdhash_workers=config.PWDHASH_WORKERS,
+    )
+
+
+def int_list(value: str) -> list[int]:
+    return [int(entry) for entry in value.split(',')]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int_list, default=[10, 1000],
+                        help='comma separated numbers of users')
+    parser.add_argument('--roles', type=int_list, default=[5, 50],
+                        help='comma separated numbers of roles')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 8, 32],
+                        help='comma separated numbers of parallel clients')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per measurement')
+    parser.add_argument('--login-requests', type=int, default=40,
+                        help='requests per measurement of POST /token')
+    parser.add_argument('--endpoints', nargs='+', default=list(ENDPOINTS),
+                        choices=list(ENDPOINTS), metavar='ENDPOINT',
+                        help='endpoints to measure (default: all)')
+    parser.add_argument('--output', help='write results (json) to this file')
+    args = parser.parse_args()
+
+    # never drop a database that is not the temporary one
+    if str(database.SQLALCHEMY_DATABASE_URL.database) != f'{TMP_DIR}/bench.db':
+        parser.error('DATABASE_URL is set in config.json, remove it first')
+
+    # logging and the request itself would be measured otherwise
+    logging.getLogger('authopie').setLevel(logging.WARNING)
+
+    meta = metadata()
+    print(f'{"endpoint":<28} {"users":>6} {"roles":>5} {"conc":>4} '
+          f'{"req/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"errors":>6}',
+          file=sys.stderr)
+
+    async def run_all() -> list[dict]:
+        results = []
+        for users, roles in itertools.product(args.users, args.roles):
+            results.extend(await run_scenario(users, roles, args))
+        return results
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    document = dict(meta=meta, results=results)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(document, fh, indent=4)
+
+
+if __name__ == '__main__':
+    main()
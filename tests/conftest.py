@@ -0,0 +1,52 @@
+"""
+fixtures: the FastAPI app with a temporary SQLite database
+run from repo root (needs config.json): python -m pytest
+"""
+
+import os
+import re
+import shutil
+import tempfile
+
+import pytest
+
+# temporary database, has to be set before the app (config) is imported
+TMP_DIR = tempfile.mkdtemp(prefix='authopie-test-')
+os.environ['DATABASE_URL'] = f'sqlite:///{TMP_DIR}/test.db'
+# no background key rotation while testing
+os.environ['KEY_ROTATION_INTERVAL'] = '0'
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from authopie.src import config  # noqa: E402
+from authopie.src.main import app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def client():
+    with TestClient(app, base_url='https://127.0.0.1') as test_client:
+        yield test_client
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def login(client):
+    """ returns access token of given user (default: admin) """
+
+    def login(
+        username: str = config.DEFAULT_USER_USERNAME,
+        password: str = config.DEFAULT_USER_PASSWORD
+    ) -> str:
+        response = client.post(
+            '/token', data=dict(username=username, password=password))
+        assert response.status_code == 200, response.text
+        # tokens are passed as header, not as cookie
+        client.cookies.clear()
+        cookies = ';'.join(response.headers.get_list('set-cookie'))
+        return re.search('access_token=([^;]+)', cookies).group(1)
+
+    return login
+
+
+def bearer(token: str) -> dict:
+    return {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,117 @@
+""" authorization semantics: revocation, token versions, wildcard scopes """
+
+from time import time
+
+import pytest
+
+from authopie.src import config
+from authopie.src.utils.constants import Scope
+
+from .conftest import bearer
+
+
+@pytest.fixture
+def user(client, login):
+    """ creates a user with a role granting manage-users """
+
+    admin = bearer(login())
+    client.post('/role', headers=admin, json=dict(
+        name='test-staff', scopes='manage-users'))
+    client.post('/role', headers=admin, json=dict(
+        name='test-guest', scopes='test:read'))
+    response = client.post('/user', headers=admin, json=dict(
+        username='test-user', password='password', roles=['test-staff']))
+    assert response.status_code == 201, response.text
+    yield 'test-user'
+    client.delete('/user/test-user', headers=admin)
+
+
+def test_revoked_token_is_rejected(client, login, user):
+    token = login(user, 'password')
+    assert client.get(f'/user/{user}', headers=bearer(token)).status_code \
+        == 200
+
+    response = client.post(
+        '/token/revoke', headers=bearer(token), json=token)
+    assert response.status_code == 204
+
+    assert client.post('/token/test', json=token).status_code == 401
+    assert client.get(f'/user/{user}', headers=bearer(token)).status_code \
+        == 401
+    # other tokens of the user stay valid
+    other = login(user, 'password')
+    assert client.get(f'/user/{user}', headers=bearer(other)).status_code \
+        == 200
+
+
+def test_token_expires_after_its_lifetime(client, login):
+    token = client.post('/token/test', json=login()).json()
+
+    # unix time, expired revocations are pruned by it
+    lifetime = config.TOKEN_LIFETIME * 60
+    assert abs(token['exp'] - (time() + lifetime)) < 60
+
+
+@pytest.mark.parametrize('change', [
+    dict(password='changed'),
+    dict(roles=['test-staff', 'test-guest']),
+])
+def test_token_of_changed_user_is_rejected(client, login, user, change):
+    token = login(user, 'password')
+    assert client.get(f'/user/{user}', headers=bearer(token)).status_code \
+        == 200
+
+    response = client.put(
+        f'/user/{user}', headers=bearer(login()), json=change)
+    assert response.status_code == 200, response.text
+
+    # issued with the old version (ver)
+    assert client.get(f'/user/{user}', headers=bearer(token)).status_code \
+        == 401
+    new = login(user, change.get('password', 'password'))
+    assert client.get(f'/user/{user}', headers=bearer(new)).status_code \
+        == 200
+
+
+def test_token_of_recreated_user_is_rejected(client, login, user):
+    token = login(user, 'password')
+    admin = bearer(login())
+
+    assert client.delete(f'/user/{user}', headers=admin).status_code == 200
+    assert client.get('/user', headers=bearer(token)).status_code == 401
+
+    # same username, no roles: old token (and its scopes) stays rejected
+    response = client.post('/user', headers=admin, json=dict(
+        username=user, password='password', roles=[]))
+    assert response.status_code == 201, response.text
+    assert client.get('/user', headers=bearer(token)).status_code == 401
+
+
+def test_token_is_rejected_after_role_change(client, login, user):
+    token = login(user, 'password')
+
+    response = client.put('/role/test-staff', headers=bearer(login()),
+                          json=dict(scopes='manage-users manage-roles'))
+    assert response.status_code == 200, response.text
+
+    assert client.get(f'/user/{user}', headers=bearer(token)).status_code \
+        == 401
+
+
+@pytest.mark.parametrize('granted, needed, allowed', [
+    ({'*'}, 'manage-users', True),
+    ({'*'}, 'billing:invoices:read', True),
+    ({'billing:*'}, 'billing:invoices', True),
+    ({'billing:*'}, 'billing:invoices:read', True),
+    ({'billing:invoices:*'}, 'billing:invoices:read', True),
+    ({'billing:invoices:read'}, 'billing:invoices:read', True),
+    ({'billing:*'}, 'billing', False),
+    ({'billing:*'}, 'billingx:read', False),
+    ({'billing:invoices:*'}, 'billing:payments:read', False),
+    ({'billing:invoices:read'}, 'billing:invoices:write', False),
+    ({'billing:invoices:read'}, 'billing:*', False),
+    ({'manage-users'}, 'manage-roles', False),
+    (set(), 'manage-users', False),
+])
+def test_wildcard_scopes(granted, needed, allowed):
+    assert (frozenset(granted) in Scope(needed)) is allowed